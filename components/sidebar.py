@@ -153,7 +153,8 @@ def render_quick_stats(sheets_manager: GoogleSheetsManager):
             
             # Botón para actualizar estadísticas
             if st.button("🔄 Actualizar", key="refresh_stats", use_container_width=True):
-                st.cache_data.clear()
+                # clear_cache limpia también el cache_resource de cursos, no solo cache_data
+                sheets_manager.clear_cache()
                 st.rerun()
                 
     except Exception as e:
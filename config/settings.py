@@ -13,8 +13,11 @@ class AppSettings:
     GOOGLE_SHEETS_RETRY_ATTEMPTS: int = 3
     
     # Email
-    EMAIL_DELAY_BETWEEN_SENDS: float = 0.8
+    EMAIL_DELAY_BETWEEN_SENDS: float = 0.8  # Espaciado promedio: tasa de 1/delay envíos por segundo
+    EMAIL_BURST_SIZE: int = 5
     EMAIL_BATCH_SIZE: int = 50
+    EMAIL_MAX_WORKERS: int = 4
+    SMTP_POOL_SIZE: int = 4
     
     # UI
     PAGE_SIZE: int = 50
@@ -653,6 +653,7 @@ def _calcular_datos_asistencia(curso_data: Dict[str, Any]) -> List[Dict[str, Any
     fechas = curso_data.get("fechas", [])
     asistencias = curso_data.get("asistencias", {})
     total_clases = len(fechas)
+    escala = 100.0 / total_clases if total_clases > 0 else 0.0  # Una división por curso
     
     for estudiante in estudiantes:
         asistencia_est = asistencias.get(estudiante, {})
@@ -664,7 +665,7 @@ def _calcular_datos_asistencia(curso_data: Dict[str, Any]) -> List[Dict[str, Any
         
         # Calcular porcentaje
         ausentes = total_clases - presentes if total_clases > 0 else 0
-        porcentaje = (presentes / total_clases * 100) if total_clases > 0 else 0
+        porcentaje = presentes * escala
         
         # Determinar estado
         if porcentaje >= 85:
@@ -1063,9 +1064,10 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
     
     elif tipo == "📋 Asistencia Detallada":
         for curso_nombre, curso_data in cursos_sede.items():
+            total_clases = len(curso_data.get("fechas", []))
+            escala = 100.0 / total_clases if total_clases > 0 else 0.0
             for estudiante in curso_data.get("estudiantes", []):
                 asistencia_est = curso_data.get("asistencias", {}).get(estudiante, {})
-                total_clases = len(curso_data.get("fechas", []))
                 
                 # Calcular presentes
                 if isinstance(asistencia_est, dict):
@@ -1078,7 +1080,7 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
                     presentes = 0
                 
                 ausentes = total_clases - presentes
-                porcentaje = (presentes / total_clases * 100) if total_clases > 0 else 0
+                porcentaje = presentes * escala
                 
                 reporte.append({
                     "Curso": curso_nombre,
@@ -1092,9 +1094,10 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
     
     elif tipo == "⚠️ Estudiantes Críticos (<70%)":
         for curso_nombre, curso_data in cursos_sede.items():
+            total_clases = len(curso_data.get("fechas", []))
+            escala = 100.0 / total_clases if total_clases > 0 else 0.0
             for estudiante in curso_data.get("estudiantes", []):
                 asistencia_est = curso_data.get("asistencias", {}).get(estudiante, {})
-                total_clases = len(curso_data.get("fechas", []))
                 
                 # Calcular presentes
                 if isinstance(asistencia_est, dict):
@@ -1106,7 +1109,7 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
                 else:
                     presentes = 0
                 
-                porcentaje = (presentes / total_clases * 100) if total_clases > 0 else 0
+                porcentaje = presentes * escala
                 
                 if porcentaje < 70:
                     reporte.append({
@@ -1122,9 +1125,10 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
         # Primero recolectar todos
         todos_estudiantes = []
         for curso_nombre, curso_data in cursos_sede.items():
+            total_clases = len(curso_data.get("fechas", []))
+            escala = 100.0 / total_clases if total_clases > 0 else 0.0
             for estudiante in curso_data.get("estudiantes", []):
                 asistencia_est = curso_data.get("asistencias", {}).get(estudiante, {})
-                total_clases = len(curso_data.get("fechas", []))
                 
                 # Calcular presentes
                 if isinstance(asistencia_est, dict):
@@ -1136,7 +1140,7 @@ def _generar_reporte(tipo: str, sede: str, cursos_sede: Dict, periodo: str):
                 else:
                     presentes = 0
                 
-                porcentaje = (presentes / total_clases * 100) if total_clases > 0 else 0
+                porcentaje = presentes * escala
                 
                 todos_estudiantes.append({
                     "Estudiante": estudiante,
@@ -1412,17 +1416,19 @@ Fecha del reporte: {{fecha_reporte}}
                         if filtro_curso == "Curso específico" and curso_nombre != curso_especifico:
                             continue
                         
+                        total_clases = len(curso_data.get("fechas", []))
+                        escala = 100.0 / total_clases if total_clases > 0 else 0.0
+                        
                         # Calcular datos para cada estudiante
                         for estudiante in curso_data.get("estudiantes", []):
                             asistencias = curso_data.get("asistencias", {}).get(estudiante, {})
-                            total_clases = len(curso_data.get("fechas", []))
                             
                             if isinstance(asistencias, dict):
                                 presentes = sum(1 for estado in asistencias.values() if estado == True)
                             else:
                                 presentes = 0
                             
-                            porcentaje = (presentes / total_clases * 100) if total_clases > 0 else 0
+                            porcentaje = presentes * escala
                             
                             # Filtrar por porcentaje si es necesario
                             if filtro_asistencia == "Solo baja asistencia (<70%)" and porcentaje >= 70:
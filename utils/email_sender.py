@@ -1,13 +1,202 @@
 # utils/email_sender.py
+import atexit
 import smtplib
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 from email.utils import formatdate
 import streamlit as st
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+from functools import lru_cache
+from contextlib import contextmanager
+from itertools import islice
 import os
+import re
+
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+class PlaceholderTemplate:
+    """
+    Plantilla con marcadores {{clave}}, separada una sola vez en literales
+    (posiciones pares) y claves (posiciones impares).
+
+    render une esos segmentos con los datos; los marcadores sin dato quedan
+    intactos.
+    """
+
+    def __init__(self, template: str):
+        self._tokens = _PLACEHOLDER_RE.split(template)
+
+    def render(self, mapping: Dict[str, Any]) -> str:
+        """Une los segmentos precompilados con los valores del destinatario."""
+        partes = self._tokens[:]
+        for i in range(1, len(partes), 2):
+            clave = partes[i]
+            partes[i] = str(mapping[clave]) if clave in mapping else "{{" + clave + "}}"
+        return "".join(partes)
+
+
+@lru_cache(maxsize=64)
+def compile_template(template: str) -> PlaceholderTemplate:
+    """Retorna la plantilla compilada (cacheada por texto)."""
+    return PlaceholderTemplate(template)
+
+
+class TokenBucket:
+    """
+    Limitador de tasa token bucket, seguro entre hilos.
+
+    Acumula hasta capacity tokens a razón de rate_per_sec; consume() solo
+    bloquea cuando no quedan tokens. Permite ráfagas cortas manteniendo el
+    promedio de envíos por segundo.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float = 1):
+        if rate_per_sec <= 0:
+            raise ValueError("rate_per_sec debe ser mayor que 0")
+        self.rate = float(rate_per_sec)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens: float = 1) -> None:
+        """Descuenta tokens, esperando lo necesario si el balde está vacío"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                espera = (tokens - self._tokens) / self.rate
+            time.sleep(espera)
+
+
+def _connect_smtp(config: Dict[str, Any]) -> smtplib.SMTP:
+    """Abre una conexión SMTP con TLS y sesión iniciada"""
+    server = smtplib.SMTP(config["server"], config["port"])
+    try:
+        server.starttls()
+        server.login(config["sender"], config["password"])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def _disconnect_smtp(server: smtplib.SMTP) -> None:
+    """Cierra una conexión SMTP sin propagar errores"""
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """
+    True si el error deja la conexión SMTP inutilizable. Los rechazos de un
+    destinatario o mensaje (SMTPRecipientsRefused, SMTPDataError, ...) no.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                          smtplib.SMTPHeloError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421  # El servidor está cerrando el canal
+    # Errores de socket (timeouts, conexión reseteada); SMTPException también es OSError
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class SMTPConnectionPool:
+    """
+    Pool de conexiones SMTP autenticadas, reutilizables entre envíos.
+
+    Las conexiones se abren de forma perezosa (hasta size simultáneas) y se
+    devuelven al pool al terminar, evitando el handshake TLS y el login por
+    email. Solo se descarta una conexión ante errores de conexión; un
+    destinatario rechazado no la invalida.
+    """
+
+    # Una conexión ociosa más tiempo que esto se verifica con NOOP antes de reutilizarla
+    IDLE_CHECK_SECONDS = 30.0
+
+    def __init__(self, smtp_config: Dict[str, Any], size: int = 4):
+        self.smtp_config = smtp_config
+        self.size = max(1, int(size))
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._closed = False
+
+    def _take_idle(self) -> Optional[smtplib.SMTP]:
+        """Retorna una conexión ociosa válida, o None si no hay"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.IDLE_CHECK_SECONDS:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except Exception:
+                pass
+            _disconnect_smtp(server)
+
+    @contextmanager
+    def acquire(self):
+        """Context manager que entrega una conexión SMTP del pool"""
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._take_idle() or _connect_smtp(self.smtp_config)
+            yield server
+        except Exception as e:
+            if server is not None and _is_connection_error(e):
+                _disconnect_smtp(server)
+                server = None
+            raise
+        finally:
+            if server is not None:
+                with self._lock:
+                    closed = self._closed
+                    if not closed:
+                        self._idle.append((server, time.monotonic()))
+                if closed:
+                    _disconnect_smtp(server)
+            self._slots.release()
+
+    def close(self) -> None:
+        """Cierra todas las conexiones ociosas del pool"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _disconnect_smtp(server)
+
+
+@st.cache_resource(show_spinner=False)
+def get_smtp_pool(server: str, port: int, sender: str, password: str,
+                  size: int = 4) -> SMTPConnectionPool:
+    """
+    Pool SMTP compartido entre reruns y sesiones, uno por configuración.
+
+    Las conexiones ociosas se cierran al terminar el proceso.
+    """
+    pool = SMTPConnectionPool(
+        {"server": server, "port": port, "sender": sender, "password": password},
+        size=size
+    )
+    atexit.register(pool.close)
+    return pool
+
 
 class EmailManager:
     """Manejador de envío de emails usando secrets de Streamlit"""
@@ -28,59 +217,151 @@ class EmailManager:
             st.error(f"✗ Configuración de email incompleta en secrets: {e}")
             return {}
     
+    def _build_message(self, to_email: str, subject: str, body: str,
+                       logo_path: str = None) -> MIMEMultipart:
+        """Construye el mensaje MIME (HTML o texto plano, con logo opcional)"""
+        msg = MIMEMultipart('related')
+        msg["From"] = self.smtp_config["sender"]
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        msg["Date"] = formatdate(localtime=True)
+
+        msg_alternative = MIMEMultipart('alternative')
+        msg.attach(msg_alternative)
+
+        if body.strip().startswith('<'):
+            msg_alternative.attach(MIMEText(body, 'html'))
+        else:
+            msg_alternative.attach(MIMEText(body, 'plain'))
+        
+        if logo_path and os.path.exists(logo_path):
+            try:
+                with open(logo_path, 'rb') as f:
+                    logo_data = f.read()
+                logo = MIMEImage(logo_data)
+                logo.add_header('Content-ID', '<logo_institucion>')
+                msg.attach(logo)
+            except Exception as e:
+                st.warning(f"△ No se pudo adjuntar el logo: {e}")
+
+        return msg
+
     def send_email(self, to_email: str, subject: str, body: str, logo_path: str = None) -> bool:
         """Envía un email individual con soporte para HTML y logo"""
         try:
             if not self.smtp_config:
                 return False
 
-            msg = MIMEMultipart('related')
-            msg["From"] = self.smtp_config["sender"]
-            msg["To"] = to_email
-            msg["Subject"] = subject
-            msg["Date"] = formatdate(localtime=True)
-
-            msg_alternative = MIMEMultipart('alternative')
-            msg.attach(msg_alternative)
-
-            if body.strip().startswith('<'):
-                msg_alternative.attach(MIMEText(body, 'html'))
-            else:
-                msg_alternative.attach(MIMEText(body, 'plain'))
-            
-            if logo_path and os.path.exists(logo_path):
-                try:
-                    with open(logo_path, 'rb') as f:
-                        logo_data = f.read()
-                    logo = MIMEImage(logo_data)
-                    logo.add_header('Content-ID', '<logo_institucion>')
-                    msg.attach(logo)
-                except Exception as e:
-                    st.warning(f"△ No se pudo adjuntar el logo: {e}")
-
-            server = smtplib.SMTP(self.smtp_config["server"], self.smtp_config["port"])
-            server.starttls()
-            server.login(self.smtp_config["sender"], self.smtp_config["password"])
-            server.send_message(msg)
-            server.quit()
+            msg = self._build_message(to_email, subject, body, logo_path)
+
+            server = _connect_smtp(self.smtp_config)
+            try:
+                server.send_message(msg)
+            finally:
+                _disconnect_smtp(server)
             return True
 
         except Exception as e:
             st.error(f"✗ Error enviando email a {to_email}: {e}")
             return False
     
-    def send_bulk_emails(self, destinatarios: List[Dict[str, Any]], subject: str, 
-                        body_template: str, is_html: bool = False, delay: float = 0.6) -> Dict[str, Any]:
+    def _send_one(self, destino: Dict[str, Any], subject: str, template: PlaceholderTemplate,
+                  pool: SMTPConnectionPool, limiter: Optional[TokenBucket]) -> Tuple[Dict[str, Any], bool, Optional[Exception]]:
+        """
+        Valida, personaliza y envía el email de un destinatario.
+
+        Retorna (detalle, enviado, error de envío). Se ejecuta en hilos de
+        trabajo, por lo que no llama a st.*.
+        """
+        email_destino = destino.get("email")
+        if not email_destino or email_destino == "No registrado":
+            return {
+                "estudiante": destino.get("estudiante", "N/A"),
+                "email": email_destino or "N/A",
+                "status": "Sin email válido"
+            }, False, None
+
+        estudiante = destino.get("estudiante", "")
+        try:
+            personalized_body = template.render(
+                {key: str(value) if value else "" for key, value in destino.items()}
+            )
+        except Exception as e:
+            return {"estudiante": estudiante, "email": email_destino, "status": f"Error: {str(e)[:60]}"}, False, None
+
+        if limiter is not None:
+            limiter.consume()
+        try:
+            with pool.acquire() as server:
+                server.send_message(self._build_message(email_destino, subject, personalized_body))
+        except Exception as e:
+            return {"estudiante": estudiante, "email": email_destino, "status": "Falló ❌"}, False, e
+
+        return {"estudiante": estudiante, "email": email_destino, "status": "Enviado ✅"}, True, None
+
+    @staticmethod
+    def _failed_detail(destino: Dict[str, Any]) -> Dict[str, Any]:
+        """Detalle de un destinatario cuyo envío falló por un error inesperado"""
+        return {
+            "estudiante": destino.get("estudiante", "N/A"),
+            "email": destino.get("email") or "N/A",
+            "status": "Falló ❌"
+        }
+
+    def _send_chunk(self, bloque: List[Tuple[int, Dict[str, Any]]], subject: str,
+                    template: PlaceholderTemplate, pool: SMTPConnectionPool,
+                    limiter: Optional[TokenBucket], avance: List[int],
+                    slot: int) -> List[Tuple[int, Dict[str, Any], bool, Optional[Exception]]]:
         """
-        Envía emails masivos con delay controlado para evitar límites SMTP.
+        Envía los emails de un bloque ya armado por el hilo principal.
+
+        Un error inesperado con un destinatario solo marca esa fila como
+        fallida. Los errores se retornan y se reportan desde el hilo principal.
+        """
+        resultados = []
+        for i, destino in bloque:
+            try:
+                resultado = self._send_one(destino, subject, template, pool, limiter)
+            except Exception as e:
+                resultado = (self._failed_detail(destino), False, e)
+            resultados.append((i, *resultado))
+            avance[slot] += 1
+        return resultados
+
+    def send_bulk_emails(self, destinatarios: Iterable[Dict[str, Any]], subject: str, 
+                        body_template: str, is_html: bool = False, delay: float = 0.6,
+                        chunk_size: int = 50, max_workers: int = 1,
+                        pool: Optional[SMTPConnectionPool] = None,
+                        rate_limiter: Optional[TokenBucket] = None,
+                        total: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Envía emails masivos con tasa controlada para evitar límites SMTP.
+
+        destinatarios puede ser una lista o un generador: se lee en el hilo que
+        llama (puede hacer E/S o usar st.*), en bloques de hasta chunk_size, y
+        los hilos de trabajo solo reciben bloques ya armados. Como hay a lo más
+        dos bloques por hilo en vuelo, un generador nunca se materializa
+        completo. Para generadores, total (si se conoce) dimensiona los
+        bloques y la barra de progreso.
+        Las conexiones SMTP salen de pool (o de un pool temporal para este
+        envío), por lo que el handshake TLS y el login se hacen una vez por
+        conexión y no por email. Con max_workers > 1 varios bloques se envían
+        en paralelo, solapando latencia de red.
+
+        La tasa global la controla rate_limiter (compartido por todos los
+        hilos); sin él, se usa un token bucket de 1/delay envíos por segundo
+        sin ráfagas, equivalente a esperar delay entre envíos.
         """
         if not self.smtp_config:
             return {"sent": 0, "failed": 0, "total": 0, "details": []}
         
+        if total is None and hasattr(destinatarios, "__len__"):
+            total = len(destinatarios)
+
         results: Dict[str, Any] = {
             "sent": 0,
             "failed": 0,
-            "total": len(destinatarios),
+            "total": total or 0,
             "details": []
         }
 
@@ -91,54 +372,77 @@ class EmailManager:
             progress_bar = None
             status_text = None
 
-        for i, destino in enumerate(destinatarios):
-            try:
-                email_destino = destino.get("email")
-                if not email_destino or email_destino == "No registrado":
-                    results["failed"] += 1
-                    results["details"].append({
-                        "estudiante": destino.get("estudiante", "N/A"),
-                        "email": email_destino or "N/A",
-                        "status": "Sin email válido"
-                    })
-                    continue
-
-                personalized_body = body_template
-                for key, value in destino.items():
-                    placeholder = f"{{{{{key}}}}}"
-                    if placeholder in personalized_body:
-                        personalized_body = personalized_body.replace(placeholder, str(value) if value else "")
-                
-                if self.send_email(email_destino, subject, personalized_body):
-                    results["sent"] += 1
-                    results["details"].append({
-                        "estudiante": destino.get("estudiante", ""),
-                        "email": email_destino,
-                        "status": "Enviado ✅"
-                    })
-                else:
-                    results["failed"] += 1
-                    results["details"].append({
-                        "estudiante": destino.get("estudiante", ""),
-                        "email": email_destino,
-                        "status": "Falló ❌"
-                    })
-                    
-            except Exception as e:
-                results["failed"] += 1
-                results["details"].append({
-                    "estudiante": destino.get("estudiante", ""),
-                    "email": destino.get("email", ""),
-                    "status": f"Error: {str(e)[:60]}"
-                })
-
-            if i < len(destinatarios) - 1:
-                time.sleep(delay)
-
-            if progress_bar:
-                progress = (i + 1) / len(destinatarios)
-                progress_bar.progress(progress)
-                if status_text:
-                    status_text.caption(f"📤 Enviando... {i+1}/{len(destinatarios)} - {results['sent']} enviados")
+        # Plantilla separada en segmentos una vez por envío; por destinatario solo se unen
+        template = compile_template(body_template)
+
+        # Bloques de hasta chunk_size, achicados para ocupar todos los hilos
+        workers = max(1, int(max_workers))
+        tam_bloque = int(chunk_size)
+        if total:
+            tam_bloque = min(tam_bloque, -(-total // workers))
+            workers = min(workers, total)
+        destinos = enumerate(destinatarios)
+        max_en_vuelo = 2 * workers
+        avance: List[int] = []  # una posición por bloque; solo su hilo la escribe
+        if rate_limiter is None and delay > 0:
+            rate_limiter = TokenBucket(rate_per_sec=1.0 / delay, capacity=1)
+
+        pool_propio = pool is None
+        if pool_propio:
+            pool = SMTPConnectionPool(self.smtp_config, size=workers)
+
+        details: Dict[int, Dict[str, Any]] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pendientes: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+                agotado = False
+                while True:
+                    # Armar bloques en este hilo hasta llenar la ventana de envío
+                    while not agotado and len(pendientes) < max_en_vuelo:
+                        try:
+                            bloque = list(islice(destinos, tam_bloque))
+                        except Exception as e:
+                            st.error(f"✗ Error leyendo destinatarios: {e}")
+                            bloque = []
+                        if not bloque:
+                            agotado = True
+                            break
+                        avance.append(0)
+                        futuro = executor.submit(self._send_chunk, bloque, subject, template,
+                                                 pool, rate_limiter, avance, len(avance) - 1)
+                        pendientes[futuro] = bloque
+
+                    if not pendientes:
+                        break
+                    terminados, _ = wait(pendientes, timeout=0.25, return_when=FIRST_COMPLETED)
+
+                    for futuro in terminados:
+                        bloque = pendientes.pop(futuro)
+                        try:
+                            filas = futuro.result()
+                        except Exception as e:
+                            # El bloque completo queda como fallido; el resto se conserva
+                            filas = [(i, self._failed_detail(destino), False, e) for i, destino in bloque]
+
+                        for i, detalle, enviado, error in filas:
+                            details[i] = detalle
+                            if enviado:
+                                results["sent"] += 1
+                            else:
+                                results["failed"] += 1
+                            if error is not None:
+                                st.error(f"✗ Error enviando email a {detalle['email']}: {error}")
+
+                    if progress_bar:
+                        hechos = sum(avance)
+                        if total:
+                            progress_bar.progress(min(hechos / total, 1.0))
+                        if status_text:
+                            status_text.caption(f"📤 Enviando... {hechos}/{total or '?'} - {results['sent']} enviados")
+        finally:
+            if pool_propio:
+                pool.close()
 
+        results["details"] = [details[i] for i in sorted(details)]
+        results["total"] = len(details)
         return results
\ No newline at end of file
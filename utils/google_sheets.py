@@ -1,19 +1,35 @@
 # utils/google_sheets.py
 import gspread
 import pandas as pd
-import json
+try:
+    import orjson as _json  # Opcional: parseo más rápido de credenciales
+except ImportError:
+    import json as _json
 import streamlit as st
 from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import time
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import ChainMap, defaultdict
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# === CONSTANTES DE PARSEO ===
+# Hojas que no son cursos ni registros de asistencia
+SKIP_SHEETS = frozenset({"MAILS", "CONFIG", "METADATA", "CORREOS", "EMAILS", "PROFESORES"})
+# Encabezados que pueden aparecer en la columna de estudiantes/fechas (comparar con casefold)
+STUDENT_HEADERS = frozenset({"nombre", "estudiante", "alumno"})
+DATE_HEADERS = frozenset({"fecha", "clase", "día", "dia"})
+# Valores de texto que cuentan como asistencia
+PRESENT_VALUES = frozenset({"true", "1", "si", "sí", "presente", "p"})
+# Nombres posibles de la hoja de emails, en orden de preferencia
+EMAIL_SHEET_NAMES = ("MAILS", "CORREOS", "EMAILS")
+
 # === DECORADOR DE RATE LIMITING MEJORADO ===
 def rate_limited(calls_per_minute=45):
     """
@@ -90,6 +106,12 @@ def retry_with_backoff(max_retries=3, initial_delay=1.5, backoff_factor=2.5,
     Decorador para reintentar operaciones con backoff exponencial.
     Especialmente útil para errores 429 de Google Sheets API.
     """
+    # isinstance acepta una tupla de clases directamente
+    if isinstance(retry_exceptions, type):
+        retry_exceptions = (retry_exceptions,)
+    else:
+        retry_exceptions = tuple(retry_exceptions)
+    
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -116,7 +138,7 @@ def retry_with_backoff(max_retries=3, initial_delay=1.5, backoff_factor=2.5,
                         should_retry = True
                         logger.warning(f"Error 429 detectado en {func.__name__}. Reintentando...")
                     
-                    elif any(exc_type for exc_type in retry_exceptions if isinstance(e, exc_type)):
+                    elif isinstance(e, retry_exceptions):
                         should_retry = True
                     
                     # Si no debemos reintentar o es el último intento, lanzar excepción
@@ -142,7 +164,7 @@ def _get_gsheets_client():
         if "google" not in st.secrets or "credentials" not in st.secrets["google"]:
             raise ValueError("✗ No se encontraron credenciales de Google en secrets")
         
-        creds_info = json.loads(st.secrets["google"]["credentials"])
+        creds_info = _json.loads(st.secrets["google"]["credentials"])
         
         scopes = [
             "https://www.googleapis.com/auth/spreadsheets",
@@ -156,7 +178,7 @@ def _get_gsheets_client():
         logger.info("✓ Cliente de Google Sheets inicializado exitosamente")
         return client
         
-    except json.JSONDecodeError as e:
+    except _json.JSONDecodeError as e:
         logger.error(f"✗ Error en formato JSON de credenciales: {e}")
         st.error("✗ Error en formato de credenciales JSON. Verifica secrets.toml")
         raise
@@ -165,18 +187,83 @@ def _get_gsheets_client():
         st.error(f"✗ Error inicializando Google Sheets: {str(e)[:100]}")
         raise
 
+# === DESCARGA PARALELA DE HOJAS ===
+MAX_FETCH_WORKERS = 8
+# Celdas que usa el parseo de cursos: metadatos en columna B, estudiantes y fechas en A (filas 1-36)
+COURSE_SHEET_RANGE = "A1:B36"
+COURSE_SHEET_WIDTH = 2  # Columnas de COURSE_SHEET_RANGE
+# Columnas de las hojas de asistencia (Estudiante, Fecha, Asistencia, ...)
+ATTENDANCE_SHEET_RANGE = "A:D"
+
+def _fetch_worksheets_values(worksheets: List[Any]) -> Dict[str, Any]:
+    """
+    Descarga get_all_values() de varias hojas en paralelo (trabajo de I/O).
+    Retorna {titulo: valores}; si una hoja falla, su valor es la excepción,
+    para que el llamador la maneje sin abortar el resto.
+    """
+    results = {}
+    if not worksheets:
+        return results
+    
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(worksheets))) as executor:
+        futures = {executor.submit(ws.get_all_values): ws.title for ws in worksheets}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    
+    return results
+
+def _batch_get_sheets_values(spreadsheet: Any, sheet_titles: List[str], cell_range: str) -> Dict[str, List[List[str]]]:
+    """
+    Lee el mismo rango de varias hojas con una sola llamada values.batchGet.
+    Retorna {titulo: valores}, en el orden de sheet_titles.
+    """
+    if not sheet_titles:
+        return {}
+    
+    ranges = ["'{}'!{}".format(title.replace("'", "''"), cell_range) for title in sheet_titles]
+    response = spreadsheet.values_batch_get(ranges)
+    value_ranges = response.get("valueRanges", [])
+    
+    return {
+        title: value_range.get("values", [])
+        for title, value_range in zip(sheet_titles, value_ranges)
+    }
+
+def _get_sheet_values(spreadsheet: Any, sheet_title: str, columns: str = "A:Z") -> Optional[List[List[str]]]:
+    """
+    Lee los valores de una hoja por su título con values_get, sin pasar por
+    la consulta de metadatos que hace spreadsheet.worksheet().
+    Retorna None si la hoja no existe (la API rechaza el rango).
+    """
+    quoted_title = sheet_title.replace("'", "''")
+    try:
+        response = spreadsheet.values_get(f"'{quoted_title}'!{columns}")
+    except gspread.exceptions.APIError as e:
+        if "Unable to parse range" in str(e):
+            return None
+        raise
+    return response.get("values", [])
+
 # === FUNCIÓN DE CARGA DE CURSOS OPTIMIZADA ===
-@st.cache_data(ttl=1800, show_spinner=False)  # 30 minutos de cache
+@st.cache_resource(ttl=1800, show_spinner=False)  # 30 minutos de cache, sin copia por acceso
 @retry_with_backoff(max_retries=2, initial_delay=2)
 @rate_limited(calls_per_minute=40)  # Más conservador que el límite real
-def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
+def _load_courses_raw(clases_sheet_id: str) -> Tuple[Dict[str, Any], Dict[str, Tuple[str, ...]], Dict[str, Tuple[str, ...]]]:
     """
     Carga los cursos desde Google Sheets de forma segura y optimizada.
     Incluye manejo de errores por hoja y validación de datos.
+    Retorna (cursos, índice profesor -> cursos, índice sede -> cursos).
+
+    El resultado se comparte entre todas las sesiones (st.cache_resource no
+    copia en cada acceso): NO debe modificarse. Usar GoogleSheetsManager.load_courses(),
+    que entrega una copia superficial por curso.
     """
     if not clases_sheet_id:
         logger.error("✗ ID de hoja de clases no proporcionado")
-        return {}
+        return {}, {}, {}
     
     try:
         client = _get_gsheets_client()
@@ -185,32 +272,49 @@ def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
         
         if not worksheets:
             logger.warning("△ No se encontraron hojas en el spreadsheet")
-            return {}
+            return {}, {}, {}
         
         courses = {}
         successful_sheets = 0
         failed_sheets = 0
+        now_iso = datetime.now().isoformat()  # Marca común para toda la carga
+        
+        # Saltar hojas que no son cursos y leer el resto en una sola llamada
+        course_sheets = [ws for ws in worksheets if ws.title.upper() not in SKIP_SHEETS]
+        try:
+            sheet_values = _batch_get_sheets_values(
+                spreadsheet, [ws.title for ws in course_sheets], COURSE_SHEET_RANGE
+            )
+            # batchGet no rellena filas cortas o vacías: completarlas con "" como get_all_values
+            sheet_values = {
+                titulo: [fila + [""] * (COURSE_SHEET_WIDTH - len(fila)) for fila in valores]
+                for titulo, valores in sheet_values.items()
+            }
+        except Exception as e:
+            # Si el lote falla completo, descargar hoja por hoja en paralelo
+            logger.warning(f"△ Lectura en lote falló, usando descarga por hoja: {str(e)[:80]}")
+            sheet_values = _fetch_worksheets_values(course_sheets)
         
-        for worksheet in worksheets:
+        for worksheet in course_sheets:
             sheet_name = worksheet.title
+            all_data = sheet_values.get(sheet_name)
             
-            # Saltar hojas que no son cursos
-            if sheet_name.upper() == "MAILS" or sheet_name.upper() == "CONFIG":
+            if isinstance(all_data, Exception):
+                failed_sheets += 1
+                logger.warning(f"△ Error procesando hoja '{sheet_name}': {str(all_data)[:80]}")
                 continue
             
             try:
-                # Obtener datos de forma eficiente (solo las columnas necesarias)
-                all_data = worksheet.get_all_values()
-                
                 if not all_data or len(all_data) < 5:
                     logger.warning(f"△ Hoja '{sheet_name}' vacía o con formato incorrecto")
                     failed_sheets += 1
                     continue
                 
-                # Extraer metadatos del curso
-                profesor = all_data[0][1] if len(all_data[0]) > 1 else "No asignado"
-                sede = all_data[1][1] if len(all_data) > 1 and len(all_data[1]) > 1 else "No especificada"
-                asignatura = all_data[2][1] if len(all_data) > 2 and len(all_data[2]) > 1 else "Sin asignatura"
+                # Extraer metadatos del curso (columna B de las filas 1-3; ya hay al menos 5 filas)
+                profesor, sede, asignatura = [
+                    fila[1] if len(fila) > 1 else default
+                    for fila, default in zip(all_data, ("No asignado", "No especificada", "Sin asignatura"))
+                ]
                 
                 # Extraer estudiantes (filas 4-24, columna 0)
                 estudiantes = []
@@ -220,7 +324,7 @@ def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
                 for i in range(start_row, end_row):
                     if i < len(all_data) and all_data[i] and all_data[i][0].strip():
                         estudiante = all_data[i][0].strip()
-                        if estudiante and estudiante.lower() not in ["nombre", "estudiante", "alumno"]:
+                        if estudiante and estudiante.casefold() not in STUDENT_HEADERS:
                             estudiantes.append(estudiante)
                 
                 # Extraer fechas (filas 1-36, columna 0, después del header)
@@ -232,7 +336,7 @@ def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
                     if i < len(all_data) and all_data[i] and all_data[i][0].strip():
                         fecha = all_data[i][0].strip()
                         # Validar que sea una fecha (puedes ajustar esta validación)
-                        if fecha and not fecha.lower() in ["fecha", "clase", "día"]:
+                        if fecha and fecha.casefold() not in DATE_HEADERS:
                             fechas.append(fecha)
                 
                 # Validar que el curso tenga datos mínimos
@@ -247,8 +351,10 @@ def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
                     "sede": sede.upper() if sede else "NO ESPECIFICADA",
                     "asignatura": asignatura,
                     "estudiantes": estudiantes,
+                    # Claves normalizadas (mismo formato que las de la hoja MAILS)
+                    "estudiantes_keys": [estudiante.lower() for estudiante in estudiantes],
                     "fechas": fechas if fechas else ["Sin fechas programadas"],
-                    "last_updated": datetime.now().isoformat()
+                    "last_updated": now_iso
                 }
                 
                 successful_sheets += 1
@@ -260,88 +366,187 @@ def _load_courses_raw(clases_sheet_id: str) -> Dict[str, Any]:
                 continue
         
         logger.info(f"✓ Cursos cargados: {successful_sheets} exitosos, {failed_sheets} fallados")
-        return courses
+        
+        # Índices para filtrar por profesor/sede sin recorrer todos los cursos
+        teacher_index = defaultdict(list)
+        sede_index = defaultdict(list)
+        for sheet_name, data in courses.items():
+            teacher_index[data["profesor"].lower().strip()].append(sheet_name)
+            sede_index[data["sede"]].append(sheet_name)
+        
+        return (
+            courses,
+            {key: tuple(names) for key, names in teacher_index.items()},
+            {key: tuple(names) for key, names in sede_index.items()}
+        )
         
     except gspread.exceptions.SpreadsheetNotFound:
         logger.error(f"✗ Spreadsheet no encontrado con ID: {clases_sheet_id}")
         st.error(f"✗ No se encontró la hoja de clases. Verifica el ID en secrets.toml")
-        return {}
+        return {}, {}, {}
     except Exception as e:
         logger.error(f"✗ Error crítico cargando cursos: {str(e)}")
         if "quota" in str(e).lower() or "429" in str(e):
             st.error("⚠️ Límite de API de Google Sheets alcanzado. Espera unos minutos.")
-        return {}
+        return {}, {}, {}
+
+# === PARSEO VECTORIZADO DE ASISTENCIA ===
+def _empty_attendance_frame() -> pd.DataFrame:
+    """DataFrame de asistencia vacío con las columnas esperadas."""
+    return pd.DataFrame({
+        "Curso": pd.Series(dtype=object),
+        "Estudiante": pd.Series(dtype=object),
+        "Fecha": pd.Series(dtype=object),
+        "Asistencia": pd.Series(dtype="int8"),
+    })
+
+def _parse_attendance_frame(values: List[List[str]], course_name: str = "") -> pd.DataFrame:
+    """
+    Convierte los valores crudos de una hoja de asistencia (fila 0 = encabezados)
+    en un DataFrame largo con columnas Curso, Estudiante, Fecha y Asistencia (int8).
+    Si un par estudiante/fecha se repite, prevalece el último registro.
+    """
+    header = [str(h).strip() for h in values[0]]
+    if "Estudiante" not in header or "Fecha" not in header:
+        return _empty_attendance_frame()
+
+    # Las filas pueden venir de distinto largo: se normalizan al ancho del encabezado
+    df = pd.DataFrame(values[1:]).reindex(columns=range(len(header)))
+    estudiantes = df[header.index("Estudiante")].fillna("").astype(str).str.strip()
+    fechas = df[header.index("Fecha")].fillna("").astype(str).str.strip()
+
+    if "Asistencia" in header:
+        estados = df[header.index("Asistencia")].fillna("").astype(str).str.strip().str.lower()
+        presentes = estados.isin(PRESENT_VALUES) | (pd.to_numeric(estados, errors="coerce").fillna(0) != 0)
+    else:
+        presentes = pd.Series(False, index=df.index)
+
+    parsed = pd.DataFrame({
+        "Curso": course_name,
+        "Estudiante": estudiantes,
+        "Fecha": fechas,
+        "Asistencia": presentes.astype("int8"),
+    })
+    parsed = parsed[(parsed["Estudiante"] != "") & (parsed["Fecha"] != "")]
+    return parsed.drop_duplicates(["Estudiante", "Fecha"], keep="last").reset_index(drop=True)
+
+def _attendance_frame_to_dict(frame: pd.DataFrame) -> Dict[str, Dict[str, bool]]:
+    """Vista anidada {estudiante: {fecha: asistencia}} de un DataFrame de asistencia."""
+    return {
+        estudiante: dict(zip(grupo["Fecha"].tolist(), grupo["Asistencia"].astype(bool).tolist()))
+        for estudiante, grupo in frame.groupby("Estudiante", sort=False)
+    }
 
 # === FUNCIÓN DE CARGA DE ASISTENCIA CON CACHÉ LARGO ===
 @st.cache_data(ttl=3600, show_spinner=False)  # 1 hora de cache para asistencia
 @retry_with_backoff(max_retries=2)
 @rate_limited(calls_per_minute=35)
-def _load_attendance_raw(asistencia_sheet_id: str, course_name: str = None) -> Dict[str, Dict[str, bool]]:
+def _load_attendance_frame_raw(asistencia_sheet_id: str) -> pd.DataFrame:
     """
-    Carga datos de asistencia desde Google Sheets.
-    Si se especifica course_name, carga solo ese curso.
+    Carga la asistencia de todas las hojas de curso en una sola pasada.
+    Retorna un DataFrame largo (Curso, Estudiante, Fecha, Asistencia), donde
+    Curso es el nombre de la hoja; los cursos que comparten estudiantes no se mezclan.
+    Las hojas se leen con una sola llamada values.batchGet, de modo que el
+    rate limiting y el retry de esta función corresponden a un solo request.
     """
     if not asistencia_sheet_id:
         logger.error("✗ ID de hoja de asistencia no proporcionado")
-        return {}
+        return _empty_attendance_frame()
     
     try:
         client = _get_gsheets_client()
         spreadsheet = client.open_by_key(asistencia_sheet_id)
-        asistencias = {}
+        course_sheets = [ws for ws in spreadsheet.worksheets()
+                         if ws.title.upper() not in SKIP_SHEETS]
         
-        # Determinar qué hojas cargar
-        sheets_to_load = []
-        if course_name:
-            sheets_to_load = [course_name]
-        else:
-            # Cargar todas las hojas excepto MAILS y configuraciones
-            all_sheets = [ws.title for ws in spreadsheet.worksheets()]
-            sheets_to_load = [sheet for sheet in all_sheets 
-                            if sheet.upper() not in ["MAILS", "CONFIG", "METADATA"]]
+        try:
+            sheet_values = _batch_get_sheets_values(
+                spreadsheet, [ws.title for ws in course_sheets], ATTENDANCE_SHEET_RANGE
+            )
+        except Exception as e:
+            # Si el lote falla completo, descargar hoja por hoja en paralelo
+            logger.warning(f"△ Lectura en lote de asistencia falló, usando descarga por hoja: {str(e)[:80]}")
+            sheet_values = _fetch_worksheets_values(course_sheets)
         
-        for sheet_name in sheets_to_load:
-            try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-                records = worksheet.get_all_records()
-                
-                if not records:
-                    continue
-                
-                for record in records:
-                    estudiante = str(record.get("Estudiante", "")).strip()
-                    fecha = str(record.get("Fecha", "")).strip()
-                    estado = record.get("Asistencia", 0)
-                    
-                    if estudiante and fecha:
-                        if estudiante not in asistencias:
-                            asistencias[estudiante] = {}
-                        
-                        # Convertir a booleano, manejando diferentes formatos
-                        if isinstance(estado, bool):
-                            asistencias[estudiante][fecha] = estado
-                        elif isinstance(estado, (int, float)):
-                            asistencias[estudiante][fecha] = bool(estado)
-                        elif isinstance(estado, str):
-                            estado_lower = estado.lower().strip()
-                            asistencias[estudiante][fecha] = estado_lower in ["true", "1", "si", "sí", "presente", "p"]
-                        else:
-                            asistencias[estudiante][fecha] = False
-                
-                logger.debug(f"✓ Asistencia cargada para '{sheet_name}': {len(records)} registros")
-                
-            except gspread.exceptions.WorksheetNotFound:
-                logger.debug(f"△ Hoja de asistencia '{sheet_name}' no encontrada")
+        frames = []
+        for sheet_name, values in sheet_values.items():
+            if isinstance(values, Exception):
+                logger.warning(f"△ Error cargando asistencia de '{sheet_name}': {str(values)[:60]}")
                 continue
-            except Exception as e:
-                logger.warning(f"△ Error cargando asistencia de '{sheet_name}': {str(e)[:60]}")
+            if len(values) < 2:
                 continue
+            frames.append(_parse_attendance_frame(values, sheet_name))
         
-        return asistencias
+        logger.info(f"✓ Asistencia cargada para {len(frames)} cursos")
+        if not frames:
+            return _empty_attendance_frame()
+        return pd.concat(frames, ignore_index=True)
         
     except Exception as e:
         logger.error(f"✗ Error cargando asistencia: {str(e)}")
-        return {}
+        return _empty_attendance_frame()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+@retry_with_backoff(max_retries=2)
+@rate_limited(calls_per_minute=35)
+def _load_course_attendance_frame_raw(asistencia_sheet_id: str, course_name: str) -> pd.DataFrame:
+    """
+    Carga la asistencia de un solo curso (columnas A:D de su hoja) con el
+    mismo formato que _load_attendance_frame_raw, sin descargar las hojas
+    del resto de los cursos.
+    """
+    if not asistencia_sheet_id:
+        logger.error("✗ ID de hoja de asistencia no proporcionado")
+        return _empty_attendance_frame()
+    
+    try:
+        client = _get_gsheets_client()
+        spreadsheet = client.open_by_key(asistencia_sheet_id)
+        values = _get_sheet_values(spreadsheet, course_name, ATTENDANCE_SHEET_RANGE)
+        if values is None:
+            logger.debug(f"△ Hoja de asistencia '{course_name}' no encontrada")
+            return _empty_attendance_frame()
+        if len(values) < 2:
+            return _empty_attendance_frame()
+        
+        frame = _parse_attendance_frame(values, course_name)
+        logger.debug(f"✓ Asistencia cargada para '{course_name}': {len(frame)} registros")
+        return frame
+        
+    except Exception as e:
+        logger.error(f"✗ Error cargando asistencia de '{course_name}': {str(e)}")
+        return _empty_attendance_frame()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_attendance_counts_raw(asistencia_sheet_id: str, course_name: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Presentes por estudiante: {curso: {estudiante: presentes}}.
+    Sin course_name agrega el DataFrame de todos los cursos; con course_name,
+    solo la hoja de ese curso. Llamar siempre con ambos argumentos
+    posicionales, para que coincida con la invalidación por claves.
+    """
+    if course_name is None:
+        frame = _load_attendance_frame_raw(asistencia_sheet_id)
+    else:
+        frame = _load_course_attendance_frame_raw(asistencia_sheet_id, course_name)
+    
+    presentes = frame.groupby(["Curso", "Estudiante"], sort=False)["Asistencia"].sum()
+    conteos = defaultdict(dict)
+    for (curso, estudiante), cantidad in zip(presentes.index, presentes.tolist()):
+        conteos[curso][estudiante] = cantidad
+    return dict(conteos)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_attendance_by_course_raw(asistencia_sheet_id: str) -> Dict[str, Dict[str, Dict[str, bool]]]:
+    """
+    Vista anidada de _load_attendance_frame_raw:
+    {curso: {estudiante: {fecha: asistencia}}}.
+    """
+    frame = _load_attendance_frame_raw(asistencia_sheet_id)
+    return {
+        curso: _attendance_frame_to_dict(grupo)
+        for curso, grupo in frame.groupby("Curso", sort=False)
+    }
 
 # === FUNCIÓN DE CARGA DE EMAILS OPTIMIZADA ===
 @st.cache_data(ttl=3600, show_spinner=False)  # 1 hora de cache
@@ -360,39 +565,47 @@ def _load_emails_raw(asistencia_sheet_id: str) -> Tuple[Dict[str, str], Dict[str
         client = _get_gsheets_client()
         spreadsheet = client.open_by_key(asistencia_sheet_id)
         
-        try:
-            worksheet = spreadsheet.worksheet("MAILS")
-        except gspread.exceptions.WorksheetNotFound:
+        # Probar nombres conocidos directamente, sin enumerar las hojas
+        values = None
+        for sheet_name in EMAIL_SHEET_NAMES:
+            values = _get_sheet_values(spreadsheet, sheet_name)
+            if values is not None:
+                break
+        else:
             # Intentar con mayúsculas/minúsculas diferentes
-            all_sheets = [ws.title.upper() for ws in spreadsheet.worksheets()]
-            if "MAILS" in all_sheets or "CORREOS" in all_sheets:
-                for ws in spreadsheet.worksheets():
-                    if ws.title.upper() in ["MAILS", "CORREOS", "EMAILS"]:
-                        worksheet = ws
-                        break
-                else:
-                    logger.warning("△ No se encontró hoja de emails (MAILS)")
-                    return {}, {}
+            for ws in spreadsheet.worksheets():
+                if ws.title.upper() in EMAIL_SHEET_NAMES:
+                    values = ws.get_all_values()
+                    break
             else:
                 logger.warning("△ No se encontró hoja de emails (MAILS)")
                 return {}, {}
         
-        records = worksheet.get_all_records()
+        if not values:
+            logger.info("✓ Emails cargados: 0 registros válidos")
+            return {}, {}
+        
+        # Posición de cada encabezado (si se repite, prevalece el último)
+        header_pos = {str(h).strip(): i for i, h in enumerate(values[0])}
+        df = pd.DataFrame(values[1:]).reindex(columns=range(len(values[0])))
+        
+        def columna(nombre: str, alternativo: str) -> pd.Series:
+            pos = header_pos.get(nombre, header_pos.get(alternativo))
+            if pos is None:
+                return pd.Series("", index=df.index)
+            return df[pos].fillna("").astype(str).str.strip()
+        
+        estudiantes = columna("NOMBRE ESTUDIANTE", "Estudiante")
+        apoderados = columna("NOMBRE APODERADO", "Apoderado")
+        mails = columna("MAIL APODERADO", "Email").str.lower()
         
-        emails = {}
-        nombres_apoderados = {}
-        emails_loaded = 0
+        validos = (estudiantes != "") & mails.str.contains("@", regex=False)
+        estudiantes_keys = estudiantes[validos].str.lower().tolist()
+        apoderados = apoderados[validos].replace("", "Apoderado/a")
         
-        for record in records:
-            estudiante = str(record.get("NOMBRE ESTUDIANTE", record.get("Estudiante", ""))).strip()
-            apoderado = str(record.get("NOMBRE APODERADO", record.get("Apoderado", ""))).strip()
-            email = str(record.get("MAIL APODERADO", record.get("Email", ""))).strip().lower()
-            
-            if estudiante and email and "@" in email:
-                estudiante_key = estudiante.lower().strip()
-                emails[estudiante_key] = email
-                nombres_apoderados[estudiante_key] = apoderado if apoderado else "Apoderado/a"
-                emails_loaded += 1
+        emails = dict(zip(estudiantes_keys, mails[validos].tolist()))
+        nombres_apoderados = dict(zip(estudiantes_keys, apoderados.tolist()))
+        emails_loaded = len(estudiantes_keys)
         
         logger.info(f"✓ Emails cargados: {emails_loaded} registros válidos")
         return emails, nombres_apoderados
@@ -401,6 +614,35 @@ def _load_emails_raw(asistencia_sheet_id: str) -> Tuple[Dict[str, str], Dict[str
         logger.error(f"✗ Error cargando emails: {str(e)}")
         return {}, {}
 
+# === INVALIDACIÓN SELECTIVA DE CACHE ===
+def _clear_attendance_cache(asistencia_sheet_id: str, course_name: str):
+    """
+    Invalida las entradas de asistencia afectadas por una escritura en course_name.
+    Las claves deben coincidir con la forma en que se llama a cada loader.
+    """
+    try:
+        _load_attendance_frame_raw.clear(asistencia_sheet_id)
+        _load_course_attendance_frame_raw.clear(asistencia_sheet_id, course_name)
+        _load_attendance_by_course_raw.clear(asistencia_sheet_id)
+        _load_attendance_counts_raw.clear(asistencia_sheet_id, None)
+        _load_attendance_counts_raw.clear(asistencia_sheet_id, course_name)
+    except TypeError:
+        # Versiones antiguas de Streamlit no permiten limpiar por argumentos
+        _load_attendance_frame_raw.clear()
+        _load_course_attendance_frame_raw.clear()
+        _load_attendance_by_course_raw.clear()
+        _load_attendance_counts_raw.clear()
+
+# Funciones con cache de Streamlit que lee el manager
+_CACHED_LOADERS = (
+    _load_courses_raw,
+    _load_attendance_frame_raw,
+    _load_course_attendance_frame_raw,
+    _load_attendance_by_course_raw,
+    _load_attendance_counts_raw,
+    _load_emails_raw,
+)
+
 # === MANAGER PRINCIPAL ===
 class GoogleSheetsManager:
     """
@@ -439,6 +681,17 @@ class GoogleSheetsManager:
             st.error(f"✗ Configuración incompleta en secrets.toml. Falta: {e}")
             return {}
     
+    def _load_courses_indexed(self) -> Tuple[Dict[str, Any], Dict[str, Tuple[str, ...]], Dict[str, Tuple[str, ...]]]:
+        """
+        Retorna (cursos, índice por profesor, índice por sede) desde el cache compartido.
+        Uso interno: los objetos retornados son de solo lectura.
+        """
+        sheet_ids = self.get_sheet_ids()
+        if not sheet_ids or "clases" not in sheet_ids:
+            return {}, {}, {}
+        
+        return _load_courses_raw(sheet_ids["clases"])
+    
     def load_courses(self, force_refresh: bool = False) -> Dict[str, Any]:
         """
         Carga todos los cursos desde Google Sheets.
@@ -450,20 +703,17 @@ class GoogleSheetsManager:
             Diccionario con {nombre_curso: datos_curso}
         """
         try:
-            sheet_ids = self.get_sheet_ids()
-            if not sheet_ids or "clases" not in sheet_ids:
-                return {}
-            
-            clases_sheet_id = sheet_ids["clases"]
-            
             # Forzar refresh si se solicita
             if force_refresh:
-                st.cache_data.clear()
+                _load_courses_raw.clear()
                 self._courses_cache = {}
                 logger.info("✓ Cache de cursos limpiado (force refresh)")
             
-            # Usar función con cache
-            courses = _load_courses_raw(clases_sheet_id)
+            # Usar función con cache. Copia superficial por curso: el llamador puede
+            # agregar/reemplazar claves (ej. "asistencias") sin tocar el cache compartido,
+            # pero las listas internas (estudiantes, fechas) son de solo lectura.
+            shared_courses, _, _ = self._load_courses_indexed()
+            courses = {name: dict(data) for name, data in shared_courses.items()}
             
             if self.debug_mode:
                 logger.debug(f"Cursos cargados: {len(courses)}")
@@ -493,18 +743,13 @@ class GoogleSheetsManager:
             Diccionario con cursos del profesor
         """
         try:
-            all_courses = self.load_courses()
-            if not all_courses:
-                return {}
-            
-            # Filtrar por profesor (búsqueda case-insensitive)
-            teacher_courses = {}
-            teacher_lower = teacher_name.lower().strip()
+            all_courses, teacher_index, _ = self._load_courses_indexed()
             
-            for name, data in all_courses.items():
-                profesor = data.get("profesor", "").lower().strip()
-                if profesor == teacher_lower:
-                    teacher_courses[name] = data
+            # Búsqueda case-insensitive mediante el índice precalculado
+            teacher_courses = {
+                name: dict(all_courses[name])
+                for name in teacher_index.get(teacher_name.lower().strip(), ())
+            }
             
             logger.debug(f"Cursos para profesor '{teacher_name}': {len(teacher_courses)}")
             return teacher_courses
@@ -525,23 +770,34 @@ class GoogleSheetsManager:
             Diccionario con cursos de la sede
         """
         try:
-            all_courses = self.load_courses()
-            if not all_courses:
-                return {}
+            all_courses, _, sede_index = self._load_courses_indexed()
+            
+            # Una sola carga de asistencia para todos los cursos de la sede
+            attendance_by_course = {}
+            frames_by_course = {}
+            counts_by_course = {}
+            if include_attendance:
+                sheet_ids = self.get_sheet_ids()
+                if sheet_ids and "asistencia" in sheet_ids:
+                    attendance_by_course = _load_attendance_by_course_raw(sheet_ids["asistencia"])
+                    counts_by_course = _load_attendance_counts_raw(sheet_ids["asistencia"], None)
+                    frame = _load_attendance_frame_raw(sheet_ids["asistencia"])
+                    frames_by_course = dict(tuple(frame.groupby("Curso", sort=False)))
             
-            sede_upper = sede_nombre.upper().strip()
             sede_courses = {}
             
-            for name, data in all_courses.items():
-                if data.get("sede", "").upper() == sede_upper:
-                    # Copiar datos para no modificar el cache original
-                    curso_data = data.copy()
-                    
-                    # Cargar asistencia si se solicita
-                    if include_attendance:
-                        curso_data["asistencias"] = self.load_attendance_for_course(name)
-                    
-                    sede_courses[name] = curso_data
+            for name in sede_index.get(sede_nombre.upper().strip(), ()):
+                # Vista sobre el cache compartido: las escrituras quedan en la
+                # capa superior y nunca tocan el diccionario original
+                overlay = {}
+                
+                # Asistencia del curso desde la carga común
+                if include_attendance:
+                    overlay["asistencias"] = attendance_by_course.get(name, {})
+                    overlay["asistencias_df"] = frames_by_course.get(name, _empty_attendance_frame())
+                    overlay["presentes_por_estudiante"] = counts_by_course.get(name, {})
+                
+                sede_courses[name] = ChainMap(overlay, all_courses[name])
             
             logger.info(f"Cursos para sede '{sede_nombre}': {len(sede_courses)}")
             return sede_courses
@@ -550,6 +806,47 @@ class GoogleSheetsManager:
             logger.error(f"✗ Error cargando cursos por sede: {str(e)}")
             return {}
     
+    def load_course_by_sede_and_name(self, sede_nombre: str, course_name: str,
+                                     include_attendance: bool = True) -> Dict[str, Any]:
+        """
+        Carga un solo curso de una sede.
+        
+        A diferencia de load_courses_by_sede, la asistencia se descarga solo
+        de la hoja del curso (rango A:D) y no de todos los cursos.
+        
+        Args:
+            sede_nombre: Nombre de la sede (ej: "SAN PEDRO")
+            course_name: Nombre del curso
+            include_attendance: Si True, incluye datos de asistencia
+            
+        Returns:
+            Datos del curso (misma forma que en load_courses_by_sede), o {}
+            si el curso no pertenece a la sede
+        """
+        try:
+            all_courses, _, sede_index = self._load_courses_indexed()
+            if course_name not in sede_index.get(sede_nombre.upper().strip(), ()):
+                logger.info(f"Curso '{course_name}' no encontrado en sede '{sede_nombre}'")
+                return {}
+            
+            overlay = {}
+            if include_attendance:
+                frame = _empty_attendance_frame()
+                counts = {}
+                sheet_ids = self.get_sheet_ids()
+                if sheet_ids and "asistencia" in sheet_ids:
+                    frame = _load_course_attendance_frame_raw(sheet_ids["asistencia"], course_name)
+                    counts = _load_attendance_counts_raw(sheet_ids["asistencia"], course_name)
+                overlay["asistencias"] = _attendance_frame_to_dict(frame)
+                overlay["asistencias_df"] = frame
+                overlay["presentes_por_estudiante"] = counts.get(course_name, {})
+            
+            return ChainMap(overlay, all_courses[course_name])
+            
+        except Exception as e:
+            logger.error(f"✗ Error cargando curso '{course_name}': {str(e)}")
+            return {}
+    
     def load_attendance_for_course(self, course_name: str) -> Dict[str, Dict[str, bool]]:
         """
         Carga datos de asistencia para un curso específico.
@@ -572,8 +869,10 @@ class GoogleSheetsManager:
             if cache_key in self._attendance_cache:
                 return self._attendance_cache[cache_key]
             
-            # Cargar desde API con cache
-            asistencias = _load_attendance_raw(asistencia_sheet_id, course_name)
+            # Filtrar el DataFrame cacheado de todos los cursos: al recorrer varios
+            # cursos se descarga la hoja de asistencia una sola vez
+            frame = _load_attendance_frame_raw(asistencia_sheet_id)
+            asistencias = _attendance_frame_to_dict(frame[frame["Curso"] == course_name])
             
             # Almacenar en cache local
             self._attendance_cache[cache_key] = asistencias
@@ -608,23 +907,6 @@ class GoogleSheetsManager:
             client = _get_gsheets_client()
             spreadsheet = client.open_by_key(sheet_ids["asistencia"])
             
-            # Intentar acceder a la hoja del curso
-            try:
-                worksheet = spreadsheet.worksheet(course_name)
-            except gspread.exceptions.WorksheetNotFound:
-                # Crear nueva hoja si no existe
-                logger.info(f"△ Creando nueva hoja para curso: {course_name}")
-                worksheet = spreadsheet.add_worksheet(
-                    title=course_name, 
-                    rows=1000, 
-                    cols=10
-                )
-                # Agregar encabezados
-                worksheet.append_row([
-                    "Curso", "Fecha", "Estudiante", 
-                    "Asistencia", "Timestamp", "Usuario"
-                ])
-            
             # Preparar datos para guardar
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             rows_to_append = []
@@ -639,21 +921,34 @@ class GoogleSheetsManager:
                     user
                 ])
             
-            # Guardar en lotes para evitar timeouts
-            batch_size = 50
-            for i in range(0, len(rows_to_append), batch_size):
-                batch = rows_to_append[i:i + batch_size]
-                worksheet.append_rows(batch)
-                time.sleep(0.1)  # Pequeña pausa entre lotes
+            # Intentar acceder a la hoja del curso
+            try:
+                worksheet = spreadsheet.worksheet(course_name)
+            except gspread.exceptions.WorksheetNotFound:
+                # Crear nueva hoja si no existe; los encabezados viajan en la misma
+                # escritura que los datos
+                logger.info(f"△ Creando nueva hoja para curso: {course_name}")
+                worksheet = spreadsheet.add_worksheet(
+                    title=course_name, 
+                    rows=1000, 
+                    cols=10
+                )
+                rows_to_append.insert(0, [
+                    "Curso", "Fecha", "Estudiante", 
+                    "Asistencia", "Timestamp", "Usuario"
+                ])
+            
+            # Una sola escritura para todas las filas (cuota: 60 escrituras/min)
+            if rows_to_append:
+                worksheet.append_rows(rows_to_append)
             
             # Invalidar cache de asistencia para este curso
             cache_key = f"{sheet_ids['asistencia']}_{course_name}"
             if cache_key in self._attendance_cache:
                 del self._attendance_cache[cache_key]
             
-            # Invalidar cache global de cursos
-            if hasattr(st, 'cache_data'):
-                st.cache_data.clear()
+            # Invalidar solo la asistencia afectada (cursos y emails no cambian)
+            _clear_attendance_cache(sheet_ids["asistencia"], course_name)
             
             logger.info(f"✓ Asistencia guardada para '{course_name}': {len(rows_to_append)} registros")
             return True
@@ -700,13 +995,15 @@ class GoogleSheetsManager:
             result = []
             
             for course_name, course_data in sede_courses.items():
-                for estudiante in course_data.get("estudiantes", []):
-                    estudiante_key = estudiante.strip().lower()
+                # Las claves ya vienen normalizadas desde la carga de cursos
+                for estudiante, estudiante_key in zip(course_data.get("estudiantes", []),
+                                                      course_data.get("estudiantes_keys", [])):
+                    email = emails_data.get(estudiante_key)
                     
-                    if estudiante_key in emails_data:
+                    if email:
                         result.append({
                             "estudiante": estudiante,
-                            "email": emails_data[estudiante_key],
+                            "email": email,
                             "curso": course_name,
                             "sede": sede_nombre
                         })
@@ -731,41 +1028,54 @@ class GoogleSheetsManager:
             Lista de estudiantes con baja asistencia
         """
         try:
-            sede_courses = self.load_courses_by_sede(sede_nombre, include_attendance=True)
+            sede_courses = self.load_courses_by_sede(sede_nombre, include_attendance=False)
             
             if not sede_courses:
                 return []
             
-            low_students = []
-            emails_data, _ = self.load_emails()
+            sheet_ids = self.get_sheet_ids()
+            if not sheet_ids or "asistencia" not in sheet_ids:
+                return []
             
-            for course_name, course_data in sede_courses.items():
-                total_fechas = len(course_data.get("fechas", []))
-                
-                if total_fechas == 0:
-                    continue
-                
-                asistencias = course_data.get("asistencias", {})
-                
-                for estudiante, att_data in asistencias.items():
-                    presentes = sum(1 for estado in att_data.values() if estado)
-                    porcentaje = (presentes / total_fechas) * 100 if total_fechas > 0 else 0
-                    
-                    if porcentaje < threshold:
-                        estudiante_key = estudiante.strip().lower()
-                        email = emails_data.get(estudiante_key, "No registrado")
-                        
-                        low_students.append({
-                            "estudiante": estudiante,
-                            "curso": course_name,
-                            "porcentaje": round(porcentaje, 1),
-                            "presentes": presentes,
-                            "total_clases": total_fechas,
-                            "email": email
-                        })
+            # Total de clases por curso (los cursos sin fechas no se evalúan)
+            totales = pd.Series({
+                course_name: len(course_data.get("fechas", []))
+                for course_name, course_data in sede_courses.items()
+            }, dtype="int64")
+            totales = totales[totales > 0]
+            
+            # Una sola pasada sobre toda la sede: presentes por (curso, estudiante)
+            frame = _load_attendance_frame_raw(sheet_ids["asistencia"])
+            frame = frame[frame["Curso"].isin(totales.index)]
+            presentes = frame.groupby(["Curso", "Estudiante"], sort=False)["Asistencia"].sum()
+            if presentes.empty:
+                return []
+            
+            total_por_fila = totales.reindex(presentes.index.get_level_values("Curso")).to_numpy()
+            porcentajes = presentes.to_numpy() * 100.0 / total_por_fila
+            # Filas bajo el umbral, ya ordenadas de menor a mayor porcentaje
+            bajo_umbral = (porcentajes < threshold).nonzero()[0]
+            orden = bajo_umbral[porcentajes[bajo_umbral].argsort(kind="stable")]
             
-            # Ordenar por menor porcentaje primero
-            low_students.sort(key=lambda x: x["porcentaje"])
+            emails_data, _ = self.load_emails()
+            
+            # Claves de email normalizadas de una vez (los nombres ya vienen sin espacios)
+            filas_bajas = presentes.index[orden]
+            estudiantes_keys = filas_bajas.get_level_values("Estudiante").str.lower()
+            
+            low_students = [
+                {
+                    "estudiante": estudiante,
+                    "curso": course_name,
+                    "porcentaje": round(float(porcentaje), 1),
+                    "presentes": int(presentes_est),
+                    "total_clases": int(total_fechas),
+                    "email": emails_data.get(estudiante_key, "No registrado")
+                }
+                for (course_name, estudiante), estudiante_key, porcentaje, presentes_est, total_fechas in zip(
+                    filas_bajas, estudiantes_keys, porcentajes[orden],
+                    presentes.to_numpy()[orden], total_por_fila[orden])
+            ]
             
             logger.info(f"Estudiantes con baja asistencia (<{threshold}%): {len(low_students)}")
             return low_students
@@ -783,10 +1093,10 @@ class GoogleSheetsManager:
             self._attendance_cache = {}
             self._sheet_ids_cache = None
             
-            # Limpiar cache de Streamlit
-            if hasattr(st, 'cache_data'):
-                st.cache_data.clear()
-                logger.debug("✓ Cache de Streamlit limpiado")
+            # Limpiar solo los caches de Streamlit de este módulo
+            for loader in _CACHED_LOADERS:
+                loader.clear()
+            logger.debug("✓ Cache de Streamlit limpiado")
             
             logger.info("✓ Cache del manager limpiado exitosamente")
             return True
@@ -822,9 +1132,11 @@ class GoogleSheetsManager:
             if sheet_ids.get("clases"):
                 try:
                     spreadsheet = client.open_by_key(sheet_ids["clases"])
-                    worksheets = [ws.title for ws in spreadsheet.worksheets()]
+                    # Solo los títulos: evita construir un Worksheet por hoja
+                    metadata = spreadsheet.fetch_sheet_metadata(params={"fields": "sheets.properties.title"})
+                    worksheets = [sheet["properties"]["title"] for sheet in metadata.get("sheets", [])]
                     results["clases_sheet"] = f"✅ Accesible ({len(worksheets)} hojas)"
-                    results["cursos_count"] = len([ws for ws in worksheets if ws.upper() != "MAILS"])
+                    results["cursos_count"] = sum(1 for ws in worksheets if ws.upper() not in SKIP_SHEETS)
                 except Exception as e:
                     results["clases_sheet"] = f"❌ Error: {str(e)[:50]}"
                     results["errors"].append(f"Clases: {str(e)}")
@@ -4,12 +4,59 @@ Funciones helper para ASIS CIMMA
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
 import re
-import random
+import secrets
 import string
+import time
 from typing import Dict, List, Any, Optional, Union
 from datetime import datetime, date, timedelta
+from functools import lru_cache
+
+# ===== CONSTANTES Y PATRONES PRECOMPILADOS =====
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# Caracteres no permitidos en nombres de archivo se eliminan; espacios -> '_'
+_FILENAME_TRANS = str.maketrans({**{c: None for c in '<>:"/\\|?*'}, ' ': '_'})
+
+_PASSWORD_CHARS = string.ascii_letters + string.digits + "!@#$%^&*"
+_PASSWORD_BYTES = np.frombuffer(_PASSWORD_CHARS.encode("ascii"), dtype=np.uint8)
+
+# Separador de miles chileno para format_currency
+_CLP_SEPARATORS = str.maketrans({',': '.'})
+# Posiciones de separador de miles dentro de un entero (para columnas)
+_THOUSANDS_RE = re.compile(r"\B(?=(?:\d{3})+(?!\d))")
+
+# Umbrales de get_time_ago: (mayor que, divisor, singular, plural)
+_TIME_AGO_DAYS = (
+    (365, 365, "año", "años"),
+    (30, 30, "mes", "meses"),
+    (0, 1, "día", "días"),
+)
+_TIME_AGO_SECONDS = (
+    (3600, 3600, "hora", "horas"),
+    (60, 60, "minuto", "minutos"),
+)
+
+# Patrones de usuario -> sede, en orden de prioridad (gana el primero que aparezca)
+_SEDE_PATTERNS = (
+    ('sp', 'SAN PEDRO'),
+    ('san pedro', 'SAN PEDRO'),
+    ('chillan', 'CHILLAN'),
+    ('chillán', 'CHILLAN'),
+    ('pdv', 'PEDRO DE VALDIVIA'),
+    ('valdivia', 'PEDRO DE VALDIVIA'),
+    ('conce', 'CONCEPCIÓN'),
+    ('concepción', 'CONCEPCIÓN'),
+    ('admin', 'TODAS'),
+)
+# Una alternativa con lookahead por patrón: la primera que calza es la de mayor
+# prioridad, sin importar la posición en el texto; lastindex indica cuál fue
+_SEDE_RE = re.compile(
+    "(?:" + "|".join(f"(?=.*?({re.escape(patron)}))" for patron, _ in _SEDE_PATTERNS) + ")",
+    re.DOTALL
+)
 
 def setup_page():
     """Configuración básica de la página"""
@@ -41,31 +88,54 @@ def format_date(date_obj: Union[datetime, date, str], format_str: str = "%d/%m/%
     if isinstance(date_obj, (datetime, date)):
         return date_obj.strftime(format_str)
     elif isinstance(date_obj, str):
-        try:
-            # Intentar parsear si es string
-            parsed_date = parse_date(date_obj)
-            if parsed_date:
+        # Intentar parsear si es string (parse_date no lanza excepciones)
+        parsed_date = parse_date(date_obj)
+        if parsed_date:
+            try:
                 return parsed_date.strftime(format_str)
-            return date_obj
-        except:
-            return date_obj
+            except ValueError:
+                return date_obj
+        return date_obj
     else:
         return str(date_obj)
 
-def parse_date(date_str: str, format_str: str = "%d/%m/%Y") -> Optional[datetime]:
+def _fast_parse_date(date_str: str) -> Optional[datetime]:
     """
-    Parsea un string a datetime.
-    
-    Args:
-        date_str: String de fecha
-        format_str: Formato esperado (default: dd/mm/yyyy)
-    
-    Returns:
-        Objeto datetime o None si no se puede parsear
+    Ruta rápida sin strptime para las formas numéricas de 10 caracteres
+    (DD/MM/YYYY, YYYY-MM-DD, DD-MM-YYYY, YYYY/MM/DD).
+    Retorna None si no aplica; parse_date sigue con la lista de formatos.
     """
-    if not date_str:
+    if len(date_str) != 10 or not date_str.isascii():
         return None
     
+    sep2, sep4, sep5, sep7 = date_str[2], date_str[4], date_str[5], date_str[7]
+    try:
+        if sep2 == sep5 and sep2 in "/-":
+            # DD/MM/YYYY o DD-MM-YYYY
+            day, month, year = date_str[:2], date_str[3:5], date_str[6:]
+        elif sep4 == sep7 and sep4 in "/-":
+            # YYYY-MM-DD o YYYY/MM/DD
+            year, month, day = date_str[:4], date_str[5:7], date_str[8:]
+        else:
+            return None
+        
+        if not (day.isdigit() and month.isdigit() and year.isdigit()):
+            return None
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        # Fecha imposible (ej: mes 13): puede ser MM/DD/YYYY, lo resuelve strptime
+        return None
+
+@lru_cache(maxsize=4096)
+def _parse_date_cached(date_str: str, format_str: str) -> Optional[datetime]:
+    """Parseo memoizado (datetime es inmutable, se puede compartir)."""
+    # Con el formato por defecto, las formas numéricas se resuelven sin strptime
+    # (mismo resultado que el primer formato de la lista que las acepta)
+    if format_str == "%d/%m/%Y":
+        parsed = _fast_parse_date(date_str)
+        if parsed is not None:
+            return parsed
+    
     # Lista de formatos comunes a probar
     formats_to_try = [
         format_str,
@@ -79,47 +149,63 @@ def parse_date(date_str: str, format_str: str = "%d/%m/%Y") -> Optional[datetime
     
     for fmt in formats_to_try:
         try:
-            return datetime.strptime(str(date_str).strip(), fmt)
-        except:
+            return datetime.strptime(date_str, fmt)
+        except (ValueError, TypeError):
             continue
     
     # Si no funciona con ninguno, devolver None
     return None
 
-def calculate_age(birth_date: Union[datetime, date, str]) -> Optional[int]:
+def parse_date(date_str: str, format_str: str = "%d/%m/%Y") -> Optional[datetime]:
+    """
+    Parsea un string a datetime.
+    
+    Args:
+        date_str: String de fecha
+        format_str: Formato esperado (default: dd/mm/yyyy)
+    
+    Returns:
+        Objeto datetime o None si no se puede parsear
+    """
+    if not date_str:
+        return None
+    
+    return _parse_date_cached(str(date_str).strip(), format_str)
+
+def _as_date(value: Union[datetime, date, str, None]) -> Optional[date]:
+    """Normaliza str/datetime/date a date; None si el valor no es una fecha válida."""
+    if isinstance(value, str):
+        value = parse_date(value)
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+def calculate_age(birth_date: Union[datetime, date, str], today: Optional[date] = None) -> Optional[int]:
     """
     Calcula la edad a partir de la fecha de nacimiento.
     
     Args:
         birth_date: Fecha de nacimiento
+        today: Fecha de referencia (default: hoy); pasarla al calcular muchas edades
     
     Returns:
         Edad en años o None si no se puede calcular
     """
-    try:
-        if isinstance(birth_date, str):
-            birth_date = parse_date(birth_date)
-            if not birth_date:
-                return None
-        
-        today = date.today()
-        
-        # Si ya es datetime.date, usarlo directamente
-        if isinstance(birth_date, datetime):
-            birth_date = birth_date.date()
-        elif isinstance(birth_date, date):
-            pass  # Ya es date
-        else:
-            return None
-        
-        age = today.year - birth_date.year
-        # Ajustar si aún no ha pasado el cumpleaños este año
-        if (today.month, today.day) < (birth_date.month, birth_date.day):
-            age -= 1
-        
-        return age
-    except:
+    birth_date = _as_date(birth_date)
+    if birth_date is None:
         return None
+    
+    if today is None:
+        today = date.today()
+    
+    age = today.year - birth_date.year
+    # Ajustar si aún no ha pasado el cumpleaños este año
+    if (today.month, today.day) < (birth_date.month, birth_date.day):
+        age -= 1
+    
+    return age
 
 def validate_email(email: str) -> bool:
     """
@@ -134,61 +220,61 @@ def validate_email(email: str) -> bool:
     if not email:
         return False
     
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email.strip()))
+    return bool(_EMAIL_RE.match(email.strip()))
 
 # ===== FUNCIONES EXISTENTES (las que ya tenías) =====
 
 def get_sede_from_username(username: str) -> str:  
     """Obtiene la sede del usuario desde secrets o por patrones"""  
     try:  
-        if "usuarios_sede" in st.secrets:  
-            for user_key, sede in st.secrets["usuarios_sede"].items():  
-                if user_key.lower() == username.lower():  
-                    return sede.upper()  
+        sede = _usuarios_sede_map().get(username.lower())
+        if sede:
+            return sede
     except:  
         pass  
     
-    username_lower = username.lower().strip()
-
-    sedes_mapping = {  
-        'sp': 'SAN PEDRO',  
-        'san pedro': 'SAN PEDRO',  
-        'chillan': 'CHILLAN',  
-        'chillán': 'CHILLAN',  
-        'pdv': 'PEDRO DE VALDIVIA',  
-        'valdivia': 'PEDRO DE VALDIVIA',  
-        'conce': 'CONCEPCIÓN',  
-        'concepción': 'CONCEPCIÓN',  
-        'admin': 'TODAS'  
-    }  
-    
-    for key, sede in sedes_mapping.items():  
-        if key in username_lower:  
-            return sede  
-    
-    if 'sp' in username_lower:
-        return 'SAN PEDRO'
-    elif 'chillan' in username_lower or 'chillán' in username_lower:
-        return 'CHILLAN'
-    elif 'valdivia' in username_lower or 'pdv' in username_lower:
-        return 'PEDRO DE VALDIVIA'
-    elif 'conce' in username_lower or 'concepción' in username_lower:
-        return 'CONCEPCIÓN'
-    
-    return 'TODAS'
+    return _sede_from_patterns(username.lower().strip())
+
+@lru_cache(maxsize=1)
+def _usuarios_sede_map() -> Dict[str, str]:
+    """Mapa {usuario en minúsculas: SEDE} desde secrets, construido una sola vez."""
+    usuarios_sede = {}
+    if "usuarios_sede" in st.secrets:
+        for user_key, sede in st.secrets["usuarios_sede"].items():
+            # Si un usuario aparece repetido, prevalece la primera entrada
+            usuarios_sede.setdefault(user_key.lower(), sede.upper())
+    return usuarios_sede
+
+@lru_cache(maxsize=256)
+def _sede_from_patterns(username_lower: str) -> str:
+    """Deduce la sede por patrones en el nombre de usuario (memoizado)."""
+    match = _SEDE_RE.match(username_lower)
+    return _SEDE_PATTERNS[match.lastindex - 1][1] if match else 'TODAS'
 
 def format_porcentaje(valor: float) -> str:
     """Formatea un porcentaje con 1 decimal"""
     return f"{valor:.1f}%"
 
+# (segundo epoch, fecha y hora, fecha): ambos formatos tienen resolución de un
+# segundo, así que se formatean una vez por segundo y se reutilizan
+_now_cache = (None, "", "")
+
+def _formatted_now() -> tuple:
+    """Retorna (segundo, fecha y hora, fecha) del instante actual, cacheado por segundo."""
+    global _now_cache
+    segundo = int(time.time())
+    if _now_cache[0] != segundo:
+        local = time.localtime(segundo)
+        _now_cache = (segundo, time.strftime("%Y-%m-%d %H:%M:%S", local), time.strftime("%Y-%m-%d", local))
+    return _now_cache
+
 def get_current_datetime() -> str:
     """Obtiene la fecha y hora actual formateada"""
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return _formatted_now()[1]
 
 def get_date_only() -> str:
     """Obtiene solo la fecha actual"""
-    return datetime.now().strftime("%Y-%m-%d")
+    return _formatted_now()[2]
 
 def create_progress_bar(total: int, current: int, label: str = "Procesando"):
     """Crea y actualiza una barra de progreso"""
@@ -213,59 +299,69 @@ def safe_divide(numerator: float, denominator: float) -> float:
     return numerator / denominator if denominator != 0 else 0
 
 def truncate_text(text: str, max_length: int = 100) -> str:
-    """Trunca texto y agrega '...' si es muy largo"""
+    """Trunca texto y agrega '…' si es muy largo"""
     if not text:
         return ""
     
-    if len(text) > max_length:
-        return text[:max_length] + "..."
-    return text
+    return text if len(text) <= max_length else f"{text[:max_length]}…"
 
 def format_currency(amount: float) -> str:
     """Formatea un monto como moneda chilena"""
     if amount is None:
         return "$0"
-    return f"${amount:,.0f}".replace(",", ".")
+    return f"${amount:,.0f}".translate(_CLP_SEPARATORS)
 
 def get_time_ago(timestamp: datetime) -> str:
     """Calcula hace cuánto tiempo fue una fecha"""
     if not timestamp:
         return "Nunca"
     
-    now = datetime.now()
-    diff = now - timestamp
-    
-    if diff.days > 365:
-        years = diff.days // 365
-        return f"Hace {years} año{'s' if years > 1 else ''}"
-    elif diff.days > 30:
-        months = diff.days // 30
-        return f"Hace {months} mes{'es' if months > 1 else ''}"
-    elif diff.days > 0:
-        return f"Hace {diff.days} día{'s' if diff.days > 1 else ''}"
-    elif diff.seconds > 3600:
-        hours = diff.seconds // 3600
-        return f"Hace {hours} hora{'s' if hours > 1 else ''}"
-    elif diff.seconds > 60:
-        minutes = diff.seconds // 60
-        return f"Hace {minutes} minuto{'s' if minutes > 1 else ''}"
-    else:
-        return "Hace unos segundos"
+    diff = datetime.now() - timestamp
+    
+    # Primero por días y luego por segundos del día, como timedelta los separa
+    for valor, tabla in ((diff.days, _TIME_AGO_DAYS), (diff.seconds, _TIME_AGO_SECONDS)):
+        for limite, unidad, singular, plural in tabla:
+            if valor > limite:
+                cantidad = valor // unidad
+                return f"Hace {cantidad} {plural if cantidad > 1 else singular}"
+    
+    return "Hace unos segundos"
 
 def generate_password(length: int = 8) -> str:
     """Genera una contraseña aleatoria"""
-    chars = string.ascii_letters + string.digits + "!@#$%^&*"
-    return ''.join(random.choice(chars) for _ in range(length))
+    # secrets (CSPRNG): es una credencial, no debe ser predecible
+    return ''.join(secrets.choice(_PASSWORD_CHARS) for _ in range(length))
+
+def generate_passwords(n: int, length: int = 8) -> List[str]:
+    """
+    Genera n contraseñas aleatorias de una vez (ej: al crear cuentas de un curso).
+    Usa bytes de secrets (CSPRNG) y NumPy para mapearlos al alfabeto en bloque.
+    """
+    if n <= 0:
+        return []
+    if length <= 0:
+        return [""] * n
+    
+    total = n * length
+    alfabeto = len(_PASSWORD_CHARS)
+    # Muestreo por rechazo: solo bytes < límite, para que el módulo sea uniforme
+    limite = 256 - 256 % alfabeto
+    aceptados = np.empty(0, dtype=np.uint8)
+    while aceptados.size < total:
+        faltan = total - aceptados.size
+        crudos = np.frombuffer(secrets.token_bytes(faltan + faltan // 4 + 16), dtype=np.uint8)
+        aceptados = np.concatenate([aceptados, crudos[crudos < limite]])
+    
+    bloque = _PASSWORD_BYTES[aceptados[:total] % alfabeto].tobytes().decode("ascii")
+    return [bloque[i:i + length] for i in range(0, total, length)]
 
 def sanitize_filename(filename: str) -> str:
     """Limpia un nombre de archivo para que sea seguro"""
     if not filename:
         return "archivo"
     
-    # Remover caracteres no permitidos
-    filename = re.sub(r'[<>:"/\\|?*]', '', filename)
-    # Reemplazar espacios por guiones bajos
-    filename = filename.replace(' ', '_')
+    # Remover caracteres no permitidos y reemplazar espacios por guiones bajos
+    filename = filename.translate(_FILENAME_TRANS)
     # Limitar longitud
     if len(filename) > 100:
         filename = filename[:100]
@@ -279,11 +375,13 @@ def sanitize_filename(filename: str) -> str:
 def export_to_excel(df: pd.DataFrame, filename: str = "reporte") -> bytes:  
     """Exporta DataFrame a Excel en memoria"""  
     output = io.BytesIO()  
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:  
+    # xlsxwriter escribe sin mantener el libro como objetos; constant_memory no se usa
+    # porque pandas escribe por columnas y ese modo descarta las filas ya cerradas
+    with pd.ExcelWriter(output, engine='xlsxwriter',
+                        engine_kwargs={'options': {'strings_to_urls': False}}) as writer:
         df.to_excel(writer, sheet_name='Reporte', index=False)  
     
-    output.seek(0)  
-    return output.read()
+    return output.getvalue()
 
 def days_between(date1: Union[datetime, date, str], date2: Union[datetime, date, str]) -> int:
     """
@@ -295,23 +393,12 @@ def days_between(date1: Union[datetime, date, str], date2: Union[datetime, date,
     Returns:
         Días de diferencia (absoluto)
     """
-    try:
-        if isinstance(date1, str):
-            date1 = parse_date(date1)
-        if isinstance(date2, str):
-            date2 = parse_date(date2)
-        
-        if isinstance(date1, datetime):
-            date1 = date1.date()
-        if isinstance(date2, datetime):
-            date2 = date2.date()
-        
-        if not date1 or not date2:
-            return 0
-        
-        return abs((date2 - date1).days)
-    except:
+    date1 = _as_date(date1)
+    date2 = _as_date(date2)
+    if date1 is None or date2 is None:
         return 0
+    
+    return abs((date2 - date1).days)
 
 def is_date_in_range(check_date: Union[datetime, date, str], 
                      start_date: Union[datetime, date, str], 
@@ -319,24 +406,98 @@ def is_date_in_range(check_date: Union[datetime, date, str],
     """
     Verifica si una fecha está dentro de un rango.
     """
-    try:
-        if isinstance(check_date, str):
-            check_date = parse_date(check_date)
-        if isinstance(start_date, str):
-            start_date = parse_date(start_date)
-        if isinstance(end_date, str):
-            end_date = parse_date(end_date)
-        
-        if not all([check_date, start_date, end_date]):
-            return False
-        
-        if isinstance(check_date, datetime):
-            check_date = check_date.date()
-        if isinstance(start_date, datetime):
-            start_date = start_date.date()
-        if isinstance(end_date, datetime):
-            end_date = end_date.date()
-        
-        return start_date <= check_date <= end_date
-    except:
-        return False
\ No newline at end of file
+    check_date = _as_date(check_date)
+    start_date = _as_date(start_date)
+    end_date = _as_date(end_date)
+    if check_date is None or start_date is None or end_date is None:
+        return False
+    
+    return start_date <= check_date <= end_date
+
+# ===== VERSIONES VECTORIZADAS PARA COLUMNAS DE DATAFRAME =====
+# Preferir estas sobre aplicar las funciones anteriores fila por fila.
+
+def _to_datetime_series(values: pd.Series) -> pd.Series:
+    """
+    Convierte una columna a datetime64 con las mismas reglas que parse_date.
+    Cada valor distinto se parsea una sola vez (las fechas se repiten mucho).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    
+    mapping = {
+        value: parse_date(value) if isinstance(value, str) else value
+        for value in values.dropna().unique()
+    }
+    return pd.to_datetime(values.map(mapping), errors="coerce")
+
+def _to_date_scalar(value: Union[datetime, date, str, None]) -> Optional[pd.Timestamp]:
+    """Normaliza un valor escalar de fecha a Timestamp (sin hora) o None."""
+    if isinstance(value, str):
+        value = parse_date(value)
+    if not value:
+        return None
+    return pd.Timestamp(value).normalize()
+
+def format_date_series(values: pd.Series, format_str: str = "%d/%m/%Y") -> pd.Series:
+    """
+    Versión vectorizada de format_date para una columna.
+    Los valores que no se pueden parsear se devuelven como texto sin cambios.
+    """
+    formatted = _to_datetime_series(values).dt.strftime(format_str)
+    return formatted.fillna(values.astype(str))
+
+def days_between_series(dates1: pd.Series, dates2: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de days_between: días de diferencia (absoluto) fila a fila.
+    Las filas con alguna fecha inválida dan 0.
+    """
+    diff = _to_datetime_series(dates2).dt.normalize() - _to_datetime_series(dates1).dt.normalize()
+    return diff.dt.days.abs().fillna(0).astype(int)
+
+def is_date_in_range_series(values: pd.Series,
+                            start_date: Union[datetime, date, str],
+                            end_date: Union[datetime, date, str]) -> pd.Series:
+    """
+    Versión vectorizada de is_date_in_range: máscara booleana por fila.
+    Las fechas inválidas (o un rango inválido) dan False.
+    """
+    start = _to_date_scalar(start_date)
+    end = _to_date_scalar(end_date)
+    if start is None or end is None:
+        return pd.Series(False, index=values.index)
+    
+    fechas = _to_datetime_series(values).dt.normalize()
+    return (fechas >= start) & (fechas <= end)
+
+def truncate_text_series(texts: pd.Series, max_length: int = 100) -> pd.Series:
+    """Versión vectorizada de truncate_text para una columna de texto."""
+    texts = texts.fillna("").astype(str)
+    largos = texts.str.len() > max_length
+    return texts.where(~largos, texts.str.slice(0, max_length) + "…")
+
+def format_porcentaje_series(valores: pd.Series) -> pd.Series:
+    """Versión vectorizada de format_porcentaje: textos con 1 decimal y '%'."""
+    return valores.map("{:.1f}%".format)
+
+def format_currency_series(montos: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de format_currency (separador de miles '.').
+    Los valores vacíos se formatean como "$0".
+    """
+    enteros = pd.to_numeric(montos, errors="coerce").fillna(0).round().astype("int64").astype(str)
+    return "$" + enteros.str.replace(_THOUSANDS_RE, ".", regex=True)
+
+def calculate_ages(birth_dates: pd.Series, today: Optional[date] = None) -> pd.Series:
+    """
+    Versión vectorizada de calculate_age para una columna de fechas de nacimiento.
+    Las fechas inválidas dan <NA>.
+    """
+    if today is None:
+        today = date.today()
+    
+    nacimientos = _to_datetime_series(birth_dates)
+    edades = today.year - nacimientos.dt.year
+    # Restar uno si aún no ha pasado el cumpleaños este año
+    cumple_pendiente = (nacimientos.dt.month * 100 + nacimientos.dt.day) > (today.month * 100 + today.day)
+    return (edades - cumple_pendiente.astype(int)).astype("Int64")
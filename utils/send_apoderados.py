@@ -1,15 +1,196 @@
 # utils/send_apoderados.py
 import streamlit as st
 import pandas as pd
-from typing import List, Dict, Any, Optional
+import numpy as np
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from dataclasses import dataclass
 from datetime import datetime
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import islice
+from collections import deque
 import logging
-from .email_sender import EmailManager
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .email_sender import EmailManager, TokenBucket, compile_template, get_smtp_pool
 from .google_sheets import GoogleSheetsManager
 from config.settings import AppSettings
 
 logger = logging.getLogger(__name__)
 
+# ===== NIVELES DE ASISTENCIA =====
+
+# Umbrales de nivel de asistencia (porcentaje) y textos asociados
+_NIVEL_LIMITES = (70.0, 85.0)
+_NIVEL_UMBRALES = np.array(_NIVEL_LIMITES)
+_NIVEL_NOMBRES = ("CRITICO", "REGULAR", "EXCELENTE")
+_NIVEL_RECOMENDACIONES = (
+    "Le recomendamos mejorar la asistencia para un mejor rendimiento académico.",
+    "Su asistencia es buena, pero puede mejorar.",
+    "¡Excelente asistencia! Continúe así."
+)
+
+
+def _cumple_filtro_porcentaje(porcentaje, filtro_porcentaje: Optional[float]):
+    """
+    Evalúa el filtro por porcentaje sobre un valor o un array de NumPy.
+    
+    Un filtro < 70 deja solo asistencias bajo 70%; un filtro >= 85 deja
+    solo asistencias de 85% o más; cualquier otro valor no filtra.
+    """
+    if filtro_porcentaje is None:
+        return np.ones_like(porcentaje, dtype=bool) if isinstance(porcentaje, np.ndarray) else True
+    if filtro_porcentaje < 70:
+        return porcentaje < 70
+    if filtro_porcentaje >= 85:
+        return porcentaje >= 85
+    return np.ones_like(porcentaje, dtype=bool) if isinstance(porcentaje, np.ndarray) else True
+
+
+# Desde este total de estudiantes en la sede, las estadísticas por curso se calculan en paralelo
+PARALLEL_STATS_MIN_STUDENTS = 200
+
+
+# ===== REGISTRO DE DESTINATARIO =====
+
+# Campos de estadísticas: generales o de reporte por fecha, según el caso
+_RECIPIENT_STATS_VACIAS = dict.fromkeys((
+    "porcentaje", "total_clases", "presentes", "ausentes", "recomendacion",
+    "nivel", "ultima_actualizacion", "presente_hoy", "estado_hoy"
+))
+
+
+@dataclass
+class Recipient:
+    """
+    Destinatario de un envío a apoderados.
+    
+    Con __slots__ cada registro ocupa bastante menos memoria que un dict. Se
+    declaran a mano (sin dataclass(slots=True), que exige Python 3.10), por
+    lo que los campos no tienen valores por defecto: las estadísticas que no
+    aplican se pasan en None (ver _RECIPIENT_STATS_VACIAS).
+    """
+    __slots__ = (
+        "estudiante", "curso", "email", "apoderado", "sede", "fecha_reporte",
+        *_RECIPIENT_STATS_VACIAS
+    )
+    
+    estudiante: str
+    curso: str
+    email: str
+    apoderado: str
+    sede: str
+    fecha_reporte: str
+    porcentaje: Optional[float]
+    total_clases: Optional[int]
+    presentes: Optional[int]
+    ausentes: Optional[int]
+    recomendacion: Optional[str]
+    nivel: Optional[str]
+    ultima_actualizacion: Optional[str]
+    presente_hoy: Optional[bool]
+    estado_hoy: Optional[str]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Datos para la plantilla de email, sin los campos que no aplican."""
+        return {
+            campo: valor
+            for campo in self.__slots__
+            if (valor := getattr(self, campo)) is not None
+        }
+
+
+# ===== PLANTILLAS DE EMAIL =====
+
+@lru_cache(maxsize=64)
+def _build_email_template(tipo: str, sede: str, fecha: str) -> str:
+    """Construye una plantilla predefinida; depende solo de (tipo, sede, fecha)."""
+    
+    templates = {
+        "asistencia_general": f"""
+Estimado/a {{apoderado}},
+
+Le informamos sobre la situación de asistencia de **{{estudiante}}** en el curso **{{curso}}** de la sede **{{sede}}**.
+
+**📊 Resumen de asistencia:**
+- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
+- ✅ Porcentaje de asistencia: **{{porcentaje}}%**
+- 📚 Total de clases: {{total_clases}}
+- ✅ Clases presentes: {{presentes}}
+- ❌ Clases ausentes: {{ausentes}}
+- 🎯 Nivel: {{nivel}}
+
+**💡 Recomendaciones:**
+{{recomendacion}}
+
+**📌 Importante:**
+La asistencia regular es fundamental para el éxito académico. Le recomendamos revisar este reporte con su estudiante.
+
+Saludos cordiales,
+Equipo Sede {sede}
+Preuniversitario CIMMA
+
+📍 Contacto: +56 9 XXXX XXXX
+📧 Email: contacto@cimma.cl
+        """,
+        
+        "baja_asistencia": f"""
+Estimado/a {{apoderado}},
+
+Nos dirigimos a usted para informarle que **{{estudiante}}** presenta **baja asistencia** en el curso **{{curso}}** de la sede **{{sede}}**.
+
+**🚨 Situación actual:**
+- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
+- ⚠️ Porcentaje de asistencia: **{{porcentaje}}%** (por debajo del 70% recomendado)
+- 📚 Total de clases: {{total_clases}}
+- ✅ Clases presentes: {{presentes}}
+- ❌ Clases ausentes: {{ausentes}}
+
+**🔔 Acciones recomendadas:**
+1. Revisar con su estudiante las razones de las ausencias
+2. Establecer un plan para mejorar la asistencia
+3. Contactar al profesor del curso si necesita apoyo
+
+**📞 Soporte:**
+Puede contactarnos para coordinar una reunión o recibir asesoramiento.
+
+Saludos cordiales,
+Equipo Sede {sede}
+Preuniversitario CIMMA
+
+📍 Contacto: +56 9 XXXX XXXX
+📧 Email: contacto@cimma.cl
+        """,
+        
+        "excelente_asistencia": f"""
+Estimado/a {{apoderado}},
+
+¡Tenemos excelentes noticias! **{{estudiante}}** mantiene una **asistencia ejemplar** en el curso **{{curso}}** de la sede **{{sede}}**.
+
+**🏆 Reconocimiento:**
+- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
+- 🎯 Porcentaje de asistencia: **{{porcentaje}}%** (¡Excelente!)
+- 📚 Total de clases: {{total_clases}}
+- ✅ Clases presentes: {{presentes}}
+- ❌ Clases ausentes: {{ausentes}}
+
+**✨ Felicitaciones:**
+Queremos reconocer el compromiso y responsabilidad de su estudiante. Esta dedicación es fundamental para el éxito académico.
+
+¡Siga así!
+
+Saludos cordiales,
+Equipo Sede {sede}
+Preuniversitario CIMMA
+
+📍 Contacto: +56 9 XXXX XXXX
+📧 Email: contacto@cimma.cl
+        """
+    }
+    
+    return templates.get(tipo, templates["asistencia_general"])
+
+
 class ApoderadosEmailSender:
     """Clase especializada para envíos masivos a apoderados."""
     
@@ -18,130 +199,388 @@ class ApoderadosEmailSender:
         self.sheets_manager = GoogleSheetsManager()
         self.settings = AppSettings.load_from_secrets()
         
+        # Pool SMTP compartido entre reruns e instancias (las conexiones se abren al usarse)
+        smtp_config = self.email_manager.smtp_config
+        self._smtp_pool = get_smtp_pool(
+            smtp_config["server"],
+            smtp_config["port"],
+            smtp_config["sender"],
+            smtp_config["password"],
+            size=self.settings.SMTP_POOL_SIZE
+        ) if smtp_config else None
+        
     def get_apoderados_by_filters(
         self, 
         sede: str, 
         curso: Optional[str] = None,
         filtro_porcentaje: Optional[float] = None,
-        fecha_reporte: Optional[str] = None
+        fecha_reporte: Optional[str] = None,
+        refresh: bool = False,
+        limit: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Obtiene apoderados filtrados por diferentes criterios."""
+        """
+        Obtiene apoderados filtrados por diferentes criterios.
+        
+        Retorna dicts (Recipient.to_dict()); iter_apoderados_by_filters
+        entrega los Recipient sin convertir.
+        Las cargas de emails y cursos usan los caches del manager de Google
+        Sheets; refresh=True los limpia y fuerza una descarga nueva.
+        Con limit, la búsqueda se detiene al reunir esa cantidad de apoderados.
+        """
+        apoderados_list = [
+            r.to_dict()
+            for r in islice(
+                self.iter_apoderados_by_filters(
+                    sede=sede,
+                    curso=curso,
+                    filtro_porcentaje=filtro_porcentaje,
+                    fecha_reporte=fecha_reporte,
+                    refresh=refresh
+                ),
+                limit or None
+            )
+        ]
+        
+        logger.info(f"Apoderados encontrados: {len(apoderados_list)}")
+        return apoderados_list
+    
+    def iter_apoderados_by_filters(
+        self,
+        sede: str,
+        curso: Optional[str] = None,
+        filtro_porcentaje: Optional[float] = None,
+        fecha_reporte: Optional[str] = None,
+        refresh: bool = False
+    ) -> Iterator[Recipient]:
+        """
+        Versión generadora de get_apoderados_by_filters.
+        
+        Produce los registros de a uno, a medida que se consumen, sin armar la
+        lista completa en memoria. A diferencia de get_apoderados_by_filters,
+        entrega objetos Recipient (usar to_dict() para obtener el dict).
+        """
+        emails_data, nombres_apoderados, cursos_sede = self._load_sender_data(sede, curso, refresh)
+        if not emails_data or not cursos_sede:
+            return
         
+        # Fecha del día calculada una sola vez para todo el recorrido
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        fecha_default = fecha_reporte or today_str
+        
+        # Estadísticas generales de cada curso en una pasada vectorizada,
+        # con el filtro por porcentaje aplicado como máscara
+        for curso_nombre, curso_data, stats_curso in self._iter_course_stats(
+            self._iter_cursos(cursos_sede, curso), filtro_porcentaje, today_str
+        ):
+            for estudiante, estudiante_key in self._estudiantes_con_email(curso_data, emails_data):
+                # Calcular estadísticas (ya filtradas por porcentaje)
+                stats = stats_curso.get(estudiante)
+                if stats is None:
+                    continue
+                
+                # El reporte de una fecha específica reemplaza las estadísticas generales
+                if fecha_reporte:
+                    stats = self._calculate_student_stats(
+                        estudiante, curso_nombre, curso_data, fecha_reporte, today_str
+                    )
+                
+                yield Recipient(**{
+                    **_RECIPIENT_STATS_VACIAS,
+                    "estudiante": estudiante,
+                    "curso": curso_nombre,
+                    "email": emails_data[estudiante_key],
+                    "apoderado": nombres_apoderados.get(estudiante_key, "Apoderado/a"),
+                    "sede": sede,
+                    "fecha_reporte": fecha_default,
+                    **stats
+                })
+    
+    def _load_sender_data(
+        self,
+        sede: str,
+        curso: Optional[str] = None,
+        refresh: bool = False
+    ) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, Any]]:
+        """
+        Carga de emails, nombres de apoderados y cursos de la sede.
+        
+        Con un curso específico solo se carga ese curso y su asistencia; con
+        refresh se limpian antes los caches del manager.
+        Único punto de E/S del sender: ante un error retorna estructuras vacías.
+        """
         try:
-            # Cargar emails
+            if refresh:
+                self.sheets_manager.clear_cache()
+            
             emails_data, nombres_apoderados = self.sheets_manager.load_emails()
             if not emails_data:
                 logger.warning("No se encontraron emails en la base de datos")
-                return []
-            
-            # Cargar cursos de la sede
-            cursos_sede = self.sheets_manager.load_courses_by_sede(sede)
-            if not cursos_sede:
-                logger.warning(f"No se encontraron cursos para la sede {sede}")
-                return []
-            
-            apoderados_list = []
-            
-            for curso_nombre, curso_data in cursos_sede.items():
-                # Filtrar por curso específico si se especifica
-                if curso and curso_nombre != curso:
-                    continue
-                
-                # Calcular estadísticas para cada estudiante
-                for estudiante in curso_data.get("estudiantes", []):
-                    estudiante_key = estudiante.strip().lower()
-                    
-                    # Verificar si tiene email registrado
-                    if estudiante_key not in emails_data:
-                        continue
-                    
-                    # Calcular estadísticas
-                    stats = self._calculate_student_stats(estudiante, curso_nombre, curso_data, fecha_reporte)
-                    
-                    # Aplicar filtro por porcentaje si existe
-                    if filtro_porcentaje is not None:
-                        if filtro_porcentaje < 70 and stats["porcentaje_asistencia"] >= 70:
-                            continue
-                        elif filtro_porcentaje >= 85 and stats["porcentaje_asistencia"] < 85:
-                            continue
-                    
-                    # Agregar a la lista
-                    apoderados_list.append({
-                        "estudiante": estudiante,
-                        "curso": curso_nombre,
-                        "email": emails_data[estudiante_key],
-                        "apoderado": nombres_apoderados.get(estudiante_key, "Apoderado/a"),
-                        "sede": sede,
-                        **stats
-                    })
-            
-            logger.info(f"Apoderados encontrados: {len(apoderados_list)}")
-            return apoderados_list
+                return {}, {}, {}
             
+            if curso:
+                datos = self.sheets_manager.load_course_by_sede_and_name(sede, curso)
+                cursos_sede = {curso: datos} if datos else {}
+            else:
+                cursos_sede = self.sheets_manager.load_courses_by_sede(sede)
         except Exception as e:
             logger.error(f"Error obteniendo apoderados: {e}")
             st.error(f"Error obteniendo lista de apoderados: {str(e)[:100]}")
-            return []
+            return {}, {}, {}
+        
+        if not cursos_sede:
+            logger.warning(f"No se encontraron cursos para la sede {sede}")
+        return emails_data, nombres_apoderados, cursos_sede
+    
+    @staticmethod
+    def _iter_cursos(cursos_sede: Dict[str, Any], curso: Optional[str] = None):
+        """Pares (nombre, datos) a recorrer; con un curso específico se accede directo."""
+        if curso:
+            return [(curso, cursos_sede[curso])] if curso in cursos_sede else []
+        return cursos_sede.items()
+    
+    @staticmethod
+    def _estudiantes_con_email(curso_data: Dict[str, Any], emails_data: Dict[str, str]) -> List[Tuple[str, str]]:
+        """
+        Pares (estudiante, clave) de los estudiantes con email registrado.
+        
+        Las claves del loader de emails ya vienen normalizadas en minúsculas.
+        """
+        return [
+            (estudiante, key)
+            for estudiante in curso_data.get("estudiantes", [])
+            if (key := estudiante.strip().lower()) in emails_data
+        ]
+    
+    def _count_apoderados(
+        self,
+        sede: str,
+        curso: Optional[str] = None,
+        filtro_porcentaje: Optional[float] = None
+    ) -> int:
+        """
+        Cuenta los apoderados que cumplen los filtros sin construir sus registros.
+        
+        Sin filtro por porcentaje basta con contar estudiantes con email; con
+        filtro se cuenta la máscara sobre los porcentajes, sin armar estadísticas.
+        """
+        emails_data, _, cursos_sede = self._load_sender_data(sede, curso)
+        if not emails_data:
+            return 0
+        
+        total = 0
+        for _, curso_data in self._iter_cursos(cursos_sede, curso):
+            elegibles = [estudiante for estudiante, _ in self._estudiantes_con_email(curso_data, emails_data)]
+            if filtro_porcentaje is None or not elegibles:
+                total += len(elegibles)
+                continue
+            try:
+                _, _, redondeados = self._porcentajes_curso(curso_data, elegibles)
+                total += int(np.count_nonzero(_cumple_filtro_porcentaje(redondeados, filtro_porcentaje)))
+            except Exception as e:
+                logger.error(f"Error contando apoderados del curso: {e}")
+                stats_curso = self._calculate_course_stats_vectorized(curso_data, filtro_porcentaje)
+                total += sum(1 for estudiante in elegibles if estudiante in stats_curso)
+        return total
+    
+    def _iter_course_stats(
+        self,
+        cursos_iter,
+        filtro_porcentaje: Optional[float] = None,
+        today_str: Optional[str] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Dict[str, Any]]]]:
+        """
+        Produce (nombre, datos, stats) por curso, en el mismo orden.
+        
+        Con varios cursos y suficientes estudiantes las estadísticas se calculan
+        en paralelo (las operaciones de pandas/NumPy liberan el GIL); con sedes
+        pequeñas el costo de los hilos no compensa y se calculan en serie.
+        En paralelo se envían a lo más workers cursos por adelantado, así que
+        un consumidor que se detiene antes (limit) no calcula toda la sede.
+        """
+        cursos = list(cursos_iter)
+        total_estudiantes = sum(len(datos.get("estudiantes", [])) for _, datos in cursos)
+        
+        def calcular(datos):
+            return self._calculate_course_stats_vectorized(datos, filtro_porcentaje, today_str)
+        
+        if len(cursos) > 1 and total_estudiantes > PARALLEL_STATS_MIN_STUDENTS:
+            workers = min(len(cursos), os.cpu_count() or 1)
+            restantes = iter(cursos)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                ventana = deque(
+                    (nombre, datos, executor.submit(calcular, datos))
+                    for nombre, datos in islice(restantes, workers)
+                )
+                while ventana:
+                    nombre, datos, futuro = ventana.popleft()
+                    siguiente = next(restantes, None)
+                    if siguiente is not None:
+                        ventana.append((*siguiente, executor.submit(calcular, siguiente[1])))
+                    yield nombre, datos, futuro.result()
+        else:
+            for nombre, datos in cursos:
+                yield nombre, datos, calcular(datos)
+    
+    @staticmethod
+    def _calc_porcentaje(asistencias_est: Dict[str, bool], total_fechas: int) -> Tuple[int, int, float]:
+        """Retorna (presentes, ausentes, porcentaje) de un estudiante."""
+        presentes = sum(1 for estado in asistencias_est.values() if estado)
+        ausentes = total_fechas - presentes
+        porcentaje = (presentes / total_fechas * 100) if total_fechas > 0 else 0
+        return presentes, ausentes, porcentaje
+    
+    @staticmethod
+    def _build_recomendacion(porcentaje: float) -> Tuple[str, str]:
+        """Retorna (nivel, recomendación) según el porcentaje de asistencia."""
+        # 0: < 70, 1: < 85, 2: >= 85
+        idx = bisect_right(_NIVEL_LIMITES, porcentaje)
+        return _NIVEL_NOMBRES[idx], _NIVEL_RECOMENDACIONES[idx]
     
     def _calculate_student_stats(
         self, 
         estudiante: str, 
         curso_nombre: str, 
         curso_data: Dict[str, Any],
-        fecha_reporte: Optional[str] = None
+        fecha_reporte: Optional[str] = None,
+        today_str: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Calcula estadísticas de asistencia para un estudiante."""
+        """
+        Calcula estadísticas de asistencia para un estudiante.
         
-        try:
-            asistencias_est = curso_data.get("asistencias", {}).get(estudiante, {})
-            total_fechas = len(curso_data.get("fechas", []))
-            
-            # Si hay fecha específica, calcular solo para esa fecha
-            if fecha_reporte:
-                presente = asistencias_est.get(fecha_reporte, False)
-                return {
-                    "presente_hoy": presente,
-                    "estado_hoy": "PRESENTE ✅" if presente else "AUSENTE ❌",
-                    "fecha_reporte": fecha_reporte
-                }
-            
-            # Calcular estadísticas generales
-            presentes = sum(1 for estado in asistencias_est.values() if estado)
-            ausentes = total_fechas - presentes
-            porcentaje = (presentes / total_fechas * 100) if total_fechas > 0 else 0
-            
-            # Determinar recomendación
-            if porcentaje < 70:
-                recomendacion = "Le recomendamos mejorar la asistencia para un mejor rendimiento académico."
-                nivel = "CRITICO"
-            elif porcentaje < 85:
-                recomendacion = "Su asistencia es buena, pero puede mejorar."
-                nivel = "REGULAR"
-            else:
-                recomendacion = "¡Excelente asistencia! Continúe así."
-                nivel = "EXCELENTE"
-            
+        today_str permite reutilizar la fecha del día calculada por el llamador.
+        """
+        today_str = today_str or datetime.now().strftime("%Y-%m-%d")
+        asistencias_est = (curso_data.get("asistencias") or {}).get(estudiante) or {}
+        total_fechas = len(curso_data.get("fechas") or ())
+        
+        # Si hay fecha específica, calcular solo para esa fecha
+        if fecha_reporte:
+            presente = asistencias_est.get(fecha_reporte, False)
             return {
-                "porcentaje_asistencia": round(porcentaje, 1),
-                "total_clases": total_fechas,
-                "presentes": presentes,
-                "ausentes": ausentes,
-                "recomendacion": recomendacion,
-                "nivel_asistencia": nivel,
-                "ultima_actualizacion": datetime.now().strftime("%Y-%m-%d")
+                "presente_hoy": presente,
+                "estado_hoy": "PRESENTE ✅" if presente else "AUSENTE ❌",
+                "fecha_reporte": fecha_reporte
             }
-            
+        
+        # Calcular estadísticas generales
+        presentes, ausentes, porcentaje = self._calc_porcentaje(asistencias_est, total_fechas)
+        
+        # Determinar recomendación
+        nivel, recomendacion = self._build_recomendacion(porcentaje)
+        
+        return {
+            "porcentaje": round(porcentaje, 1),
+            "total_clases": total_fechas,
+            "presentes": presentes,
+            "ausentes": ausentes,
+            "recomendacion": recomendacion,
+            "nivel": nivel,
+            "ultima_actualizacion": today_str
+        }
+    
+    @staticmethod
+    def _porcentajes_curso(
+        curso_data: Dict[str, Any],
+        estudiantes: List[str]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Retorna (presentes, porcentajes, porcentajes redondeados) alineados
+        con estudiantes.
+        
+        Los conteos de presentes vienen del cache del manager cuando el curso
+        los incluye ("presentes_por_estudiante"); si no, se agregan desde la
+        asistencia del curso.
+        """
+        conteos = curso_data.get("presentes_por_estudiante")
+        frame = curso_data.get("asistencias_df")
+        if conteos is not None:
+            # Conteos cacheados por el manager: sin groupby en cada preview o ajuste del filtro
+            presentes_por_est = pd.Series(conteos, dtype="int64")
+        elif frame is not None:
+            presentes_por_est = frame.groupby("Estudiante", sort=False)["Asistencia"].sum()
+        else:
+            matriz = pd.DataFrame.from_dict(curso_data.get("asistencias", {}), orient="index")
+            # Fechas sin registro (NaN) cuentan como ausencia
+            presentes_por_est = (matriz.notna() & matriz.astype(bool)).sum(axis=1)
+        
+        presentes = (
+            presentes_por_est.reindex(estudiantes, fill_value=0)
+            .to_numpy(dtype=np.int64)
+        )
+        
+        total_fechas = len(curso_data.get("fechas", []))
+        escala = 100.0 / total_fechas if total_fechas > 0 else 0.0
+        porcentajes = presentes * escala
+        
+        # El filtro compara el porcentaje redondeado, igual que el reporte
+        redondeados = np.array([round(p, 1) for p in porcentajes.tolist()])
+        return presentes, porcentajes, redondeados
+    
+    def _calculate_course_stats_vectorized(
+        self,
+        curso_data: Dict[str, Any],
+        filtro_porcentaje: Optional[float] = None,
+        today_str: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Calcula las estadísticas generales de todos los estudiantes de un curso.
+        
+        Equivale a llamar _calculate_student_stats por estudiante, pero los
+        conteos y porcentajes se obtienen con operaciones de pandas/NumPy
+        (ver _porcentajes_curso).
+        Si se indica filtro_porcentaje, se aplica como máscara antes de
+        construir los textos, y solo se retornan los estudiantes que lo cumplen.
+        
+        Returns:
+            Diccionario {estudiante: stats}
+        """
+        today_str = today_str or datetime.now().strftime("%Y-%m-%d")
+        estudiantes = list(curso_data.get("estudiantes", []))
+        total_fechas = len(curso_data.get("fechas", []))
+        
+        try:
+            presentes, porcentajes, redondeados = self._porcentajes_curso(curso_data, estudiantes)
         except Exception as e:
-            logger.error(f"Error calculando stats para {estudiante}: {e}")
+            logger.error(f"Error calculando stats del curso: {e}")
+            stats_curso = {
+                estudiante: self._calculate_student_stats(estudiante, "", curso_data, today_str=today_str)
+                for estudiante in estudiantes
+            }
             return {
-                "porcentaje_asistencia": 0,
-                "total_clases": 0,
-                "presentes": 0,
-                "ausentes": 0,
-                "recomendacion": "No hay datos disponibles.",
-                "nivel_asistencia": "SIN DATOS",
-                "ultima_actualizacion": datetime.now().strftime("%Y-%m-%d")
+                estudiante: stats for estudiante, stats in stats_curso.items()
+                if _cumple_filtro_porcentaje(stats["porcentaje"], filtro_porcentaje)
             }
+        
+        if filtro_porcentaje is not None and len(estudiantes):
+            mascara = _cumple_filtro_porcentaje(redondeados, filtro_porcentaje)
+            estudiantes = [e for e, ok in zip(estudiantes, mascara.tolist()) if ok]
+            presentes = presentes[mascara]
+            porcentajes = porcentajes[mascara]
+            redondeados = redondeados[mascara]
+        
+        ausentes = total_fechas - presentes
+        
+        # 0: < 70, 1: < 85, 2: >= 85 (mismos umbrales que _calculate_student_stats)
+        niveles_idx = np.searchsorted(_NIVEL_UMBRALES, porcentajes, side="right")
+        
+        return {
+            estudiante: {
+                "porcentaje": porcentaje,
+                "total_clases": total_fechas,
+                "presentes": p,
+                "ausentes": a,
+                "recomendacion": _NIVEL_RECOMENDACIONES[idx],
+                "nivel": _NIVEL_NOMBRES[idx],
+                "ultima_actualizacion": today_str
+            }
+            for estudiante, p, a, porcentaje, idx in zip(
+                estudiantes,
+                presentes.tolist(),
+                ausentes.tolist(),
+                redondeados.tolist(),
+                niveles_idx.tolist()
+            )
+        }
     
     def send_bulk_emails_to_apoderados(
         self,
@@ -155,79 +594,82 @@ class ApoderadosEmailSender:
     ) -> Dict[str, Any]:
         """Envía emails masivos a apoderados."""
         
-        try:
-            # Obtener destinatarios
+        sin_destinatarios = {
+            "success": False,
+            "message": "No se encontraron destinatarios con los criterios especificados",
+            "sent": 0,
+            "failed": 0,
+            "total": 0
+        }
+        
+        # Modo prueba - solo se arman los registros necesarios para el preview
+        if test_mode:
+            preview_limit = 3
             destinatarios_data = self.get_apoderados_by_filters(
                 sede=sede,
                 curso=curso,
                 filtro_porcentaje=filtro_porcentaje,
-                fecha_reporte=fecha_reporte
+                fecha_reporte=fecha_reporte,
+                limit=preview_limit
             )
-            
             if not destinatarios_data:
-                return {
-                    "success": False,
-                    "message": "No se encontraron destinatarios con los criterios especificados",
-                    "sent": 0,
-                    "failed": 0,
-                    "total": 0
-                }
+                return sin_destinatarios
             
-            # Modo prueba - solo mostrar preview
-            if test_mode:
-                preview_data = []
-                for d in destinatarios_data[:3]:  # Solo primeros 3 para preview
-                    preview_body = self._personalize_template(body_template, d)
-                    preview_data.append({
-                        "estudiante": d["estudiante"],
-                        "email": d["email"],
-                        "preview": preview_body[:200] + "..."
-                    })
-                
-                return {
-                    "success": True,
-                    "message": f"Modo prueba: {len(destinatarios_data)} emails listos para enviar",
-                    "preview": preview_data,
-                    "total": len(destinatarios_data)
-                }
-            
-            # Preparar destinatarios para el email manager
-            destinatarios = []
-            for apoderado in destinatarios_data:
-                destinatarios.append({
-                    "estudiante": apoderado["estudiante"],
-                    "email": apoderado["email"],
-                    "curso": apoderado["curso"],
-                    "apoderado": apoderado["apoderado"],
-                    "porcentaje": apoderado["porcentaje_asistencia"],
-                    "total_clases": apoderado["total_clases"],
-                    "presentes": apoderado["presentes"],
-                    "ausentes": apoderado["ausentes"],
-                    "sede": apoderado["sede"],
-                    "recomendacion": apoderado["recomendacion"],
-                    "nivel": apoderado.get("nivel_asistencia", ""),
-                    "fecha_reporte": fecha_reporte or datetime.now().strftime("%Y-%m-%d")
+            total = self._count_apoderados(sede, curso, filtro_porcentaje)
+            preview_data = []
+            for d in destinatarios_data:
+                preview_body = self._personalize_template(body_template, d)
+                preview_data.append({
+                    "estudiante": d["estudiante"],
+                    "email": d["email"],
+                    "preview": preview_body[:200] + "..."
                 })
             
-            # Enviar emails
+            return {
+                "success": True,
+                "message": f"Modo prueba: {total} emails listos para enviar",
+                "preview": preview_data,
+                "total": total
+            }
+        
+        total = self._count_apoderados(sede, curso, filtro_porcentaje)
+        if not total:
+            return sin_destinatarios
+        
+        # Los registros se generan a medida que el email manager arma los
+        # bloques, en el hilo del script (los hilos SMTP solo reciben bloques);
+        # solo al pasarlos a la plantilla se convierten a dict
+        destinatarios = (
+            r.to_dict()
+            for r in self.iter_apoderados_by_filters(
+                sede=sede,
+                curso=curso,
+                filtro_porcentaje=filtro_porcentaje,
+                fecha_reporte=fecha_reporte
+            )
+        )
+        
+        # Límite de tasa del envío: promedio de 1/delay por segundo con ráfagas cortas
+        delay = self.settings.EMAIL_DELAY_BETWEEN_SENDS
+        rate_limiter = (
+            TokenBucket(rate_per_sec=1.0 / delay, capacity=self.settings.EMAIL_BURST_SIZE)
+            if delay > 0 else None
+        )
+        
+        # Enviar emails (único paso de E/S que puede fallar a mitad de camino)
+        try:
             resultados = self.email_manager.send_bulk_emails(
                 destinatarios=destinatarios,
                 subject=subject,
                 body_template=body_template,
                 is_html=True,
-                delay=self.settings.EMAIL_DELAY_BETWEEN_SENDS
+                delay=delay,
+                chunk_size=self.settings.EMAIL_BATCH_SIZE,
+                max_workers=self.settings.EMAIL_MAX_WORKERS,
+                pool=self._smtp_pool,
+                rate_limiter=rate_limiter,
+                total=total
             )
-            
-            # Agregar contexto adicional
-            resultados.update({
-                "sede": sede,
-                "curso": curso or "Todos",
-                "filtro": f"Porcentaje < {filtro_porcentaje}%" if filtro_porcentaje else "Todos",
-                "fecha_envio": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            
-            return resultados
-            
         except Exception as e:
             logger.error(f"Error en envío masivo a apoderados: {e}")
             return {
@@ -237,109 +679,31 @@ class ApoderadosEmailSender:
                 "failed": 0,
                 "total": 0
             }
+        
+        # Agregar contexto adicional
+        resultados.update({
+            "sede": sede,
+            "curso": curso or "Todos",
+            "filtro": f"Porcentaje < {filtro_porcentaje}%" if filtro_porcentaje else "Todos",
+            "fecha_envio": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        
+        return resultados
     
     def _personalize_template(self, template: str, data: Dict[str, Any]) -> str:
         """Personaliza una plantilla con datos del destinatario."""
-        personalized = template
-        
-        for key, value in data.items():
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder in personalized:
-                personalized = personalized.replace(placeholder, str(value))
-        
-        return personalized
+        return compile_template(template).render(
+            {key: str(value) for key, value in data.items()}
+        )
     
+    @staticmethod
     def generate_email_template(
-        self,
         tipo: str = "asistencia_general",
         sede: str = "",
         fecha: str = ""
     ) -> str:
-        """Genera plantillas de email predefinidas."""
-        
-        templates = {
-            "asistencia_general": f"""
-Estimado/a {{apoderado}},
-
-Le informamos sobre la situación de asistencia de **{{estudiante}}** en el curso **{{curso}}** de la sede **{{sede}}**.
-
-**📊 Resumen de asistencia:**
-- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
-- ✅ Porcentaje de asistencia: **{{porcentaje}}%**
-- 📚 Total de clases: {{total_clases}}
-- ✅ Clases presentes: {{presentes}}
-- ❌ Clases ausentes: {{ausentes}}
-- 🎯 Nivel: {{nivel}}
-
-**💡 Recomendaciones:**
-{{recomendacion}}
-
-**📌 Importante:**
-La asistencia regular es fundamental para el éxito académico. Le recomendamos revisar este reporte con su estudiante.
-
-Saludos cordiales,
-Equipo Sede {sede}
-Preuniversitario CIMMA
-
-📍 Contacto: +56 9 XXXX XXXX
-📧 Email: contacto@cimma.cl
-            """,
-            
-            "baja_asistencia": f"""
-Estimado/a {{apoderado}},
-
-Nos dirigimos a usted para informarle que **{{estudiante}}** presenta **baja asistencia** en el curso **{{curso}}** de la sede **{{sede}}**.
-
-**🚨 Situación actual:**
-- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
-- ⚠️ Porcentaje de asistencia: **{{porcentaje}}%** (por debajo del 70% recomendado)
-- 📚 Total de clases: {{total_clases}}
-- ✅ Clases presentes: {{presentes}}
-- ❌ Clases ausentes: {{ausentes}}
-
-**🔔 Acciones recomendadas:**
-1. Revisar con su estudiante las razones de las ausencias
-2. Establecer un plan para mejorar la asistencia
-3. Contactar al profesor del curso si necesita apoyo
-
-**📞 Soporte:**
-Puede contactarnos para coordinar una reunión o recibir asesoramiento.
-
-Saludos cordiales,
-Equipo Sede {sede}
-Preuniversitario CIMMA
-
-📍 Contacto: +56 9 XXXX XXXX
-📧 Email: contacto@cimma.cl
-            """,
-            
-            "excelente_asistencia": f"""
-Estimado/a {{apoderado}},
-
-¡Tenemos excelentes noticias! **{{estudiante}}** mantiene una **asistencia ejemplar** en el curso **{{curso}}** de la sede **{{sede}}**.
-
-**🏆 Reconocimiento:**
-- 📅 Período evaluado: Hasta {fecha or "la fecha actual"}
-- 🎯 Porcentaje de asistencia: **{{porcentaje}}%** (¡Excelente!)
-- 📚 Total de clases: {{total_clases}}
-- ✅ Clases presentes: {{presentes}}
-- ❌ Clases ausentes: {{ausentes}}
-
-**✨ Felicitaciones:**
-Queremos reconocer el compromiso y responsabilidad de su estudiante. Esta dedicación es fundamental para el éxito académico.
-
-¡Siga así!
-
-Saludos cordiales,
-Equipo Sede {sede}
-Preuniversitario CIMMA
-
-📍 Contacto: +56 9 XXXX XXXX
-📧 Email: contacto@cimma.cl
-            """
-        }
-        
-        return templates.get(tipo, templates["asistencia_general"])
+        """Genera plantillas de email predefinidas (memoizadas por tipo, sede y fecha)."""
+        return _build_email_template(tipo, sede, fecha)
 
 # Función helper para uso rápido
 def get_apoderados_sender() -> ApoderadosEmailSender: